@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+
+import logging
+import mmap
+import os
+import struct
+import zlib
+from array import array
+from threading import Lock
+from types import CodeType
+from palette import packColor, wheelTable, rainbowFrames, gammaTables, fadeLevels
+
+# Cache file layout: header, one hold count per frame, pixels, one brightness byte per frame
+CACHE_MAGIC = b'LEDA'
+CACHE_HEADER = struct.Struct('=4sIIII')
+CACHE_EXTENSION = '.frames'
+CACHE_VERSION = 1 # Bump when compiled frames change in a way the cache key can not see
+
+class Timeline():
+    """Declarative description of an animation. Steps are only recorded here,
+    all pixel math happens once in compile()."""
+
+    def __init__(self, name, ledCount, fps):
+        self.name = name
+        self.ledCount = ledCount
+        self.fps = fps
+        self.steps = []
+
+    def hold(self, pixels, brightness, duration):
+        """Show a frame for the given number of seconds."""
+        self.steps.append(('hold', array('I', pixels), brightness, duration))
+        return self
+
+    def fade(self, pixels, fromBrightness, toBrightness, duration):
+        """Fade a frame between two brightness levels along the gamma curve."""
+        self.steps.append(('fade', array('I', pixels), fromBrightness, toBrightness, duration))
+        return self
+
+    def sequence(self, function, count, brightness, *args):
+        """Render count frames with function(index, *args) -> (pixels, seconds)."""
+        self.steps.append(('sequence', function, count, brightness, args))
+        return self
+
+    def batch(self, function, brightness, duration, *args):
+        """Render all frames at once with function(*args) -> frames, each shown for duration seconds."""
+        self.steps.append(('batch', function, brightness, duration, args))
+        return self
+
+    def key(self):
+        """Identifies the compiled result of this timeline, used as cache file name. Covers
+        the code of the functions that render frames, and the functions they call."""
+        checksum = 0
+        for step in self.steps:
+            for value in step:
+                checksum = _checksum(value, checksum)
+        return self.name + '-v' + str(CACHE_VERSION) + '-' + str(self.ledCount) + '-' + str(self.fps) + '-' + format(checksum, '08x')
+
+    def __ticks(self, duration):
+        return max(1, round(duration * self.fps))
+
+    def compile(self):
+        levels = bytearray()
+        holds = array('I')
+        pixels = array('I')
+        gamma = gammaTables()
+        for step in self.steps:
+            if step[0] == 'hold':
+                frame, brightness, duration = step[1:]
+                pixels.extend(frame)
+                levels.append(brightness)
+                holds.append(self.__ticks(duration))
+            elif step[0] == 'fade':
+                frame, fromBrightness, toBrightness, duration = step[1:]
+                for brightness in fadeLevels(fromBrightness, toBrightness, self.__ticks(duration), gamma):
+                    pixels.extend(frame)
+                    levels.append(brightness)
+                    holds.append(1)
+            elif step[0] == 'batch':
+                function, brightness, duration, args = step[1:]
+                for frame in function(*args):
+                    pixels.extend(frame)
+                    levels.append(brightness)
+                    holds.append(self.__ticks(duration))
+            else:
+                function, count, brightness, args = step[1:]
+                for index in range(count):
+                    frame, duration = function(index, *args)
+                    pixels.extend(frame)
+                    levels.append(brightness)
+                    holds.append(self.__ticks(duration))
+        return CompiledAnimation(self.ledCount, self.fps, bytes(levels), holds, pixels)
+
+class CompiledAnimation():
+    """Compact frame array that is streamed to the strip by index."""
+
+    def __init__(self, ledCount, fps, levels, holds, pixels):
+        self.ledCount = ledCount
+        self.fps = fps
+        self.levels = levels
+        self.holds = holds
+        self.frameCount = len(levels)
+        # Views into the pixel buffer, so playing a frame never copies or allocates
+        view = memoryview(pixels)
+        self.frames = [view[i * ledCount:(i + 1) * ledCount] for i in range(self.frameCount)]
+
+    def write(self, path):
+        """Write the animation to path atomically."""
+        tmpPath = path + '.tmp'
+        with open(tmpPath, 'wb') as f:
+            f.write(CACHE_HEADER.pack(CACHE_MAGIC, self.ledCount, self.fps, self.frameCount, CACHE_VERSION))
+            f.write(array('I', self.holds).tobytes())
+            for frame in self.frames:
+                f.write(frame.tobytes())
+            f.write(self.levels)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmpPath, path)
+
+    @classmethod
+    def read(cls, path):
+        """Memory map a cache file written by write()."""
+        with open(path, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, ledCount, fps, frameCount, version = CACHE_HEADER.unpack_from(data)
+        if magic != CACHE_MAGIC:
+            raise ValueError("Not an animation cache file: " + path)
+        if version != CACHE_VERSION:
+            raise ValueError("Animation cache file of version " + str(version) + ": " + path)
+        view = memoryview(data)
+        offset = CACHE_HEADER.size
+        holds = view[offset:offset + 4 * frameCount].cast('I')
+        offset += 4 * frameCount
+        pixels = view[offset:offset + 4 * ledCount * frameCount].cast('I')
+        offset += 4 * ledCount * frameCount
+        levels = view[offset:offset + frameCount]
+        if len(levels) != frameCount:
+            raise ValueError("Truncated animation cache file: " + path)
+        return cls(ledCount, fps, levels, holds, pixels)
+
+class AnimationCache():
+    """Compiles every timeline only once. Compiled animations are kept in memory and,
+    if a directory is given, stored on disk so they can be memory mapped on the next boot."""
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.animations = {}
+        self.lock = Lock()
+        if directory is not None:
+            try:
+                os.makedirs(directory, exist_ok=True)
+            except Exception as e:
+                logging.warning("Could not create animation cache directory: " + str(e))
+                self.directory = None
+
+    def load(self, timeline):
+        key = timeline.key()
+        with self.lock:
+            animation = self.animations.get(key)
+            if animation is None:
+                animation = self.__loadFromDisk(key, timeline)
+                self.animations[key] = animation
+            return animation
+
+    def preload(self, timelines):
+        """Compile timelines ahead of their first use, then remove the files no longer used."""
+        for timeline in timelines:
+            self.load(timeline)
+        self.prune()
+
+    def prune(self):
+        """Delete cache files of keys that no animation loaded so far has, like the ones
+        compiled by older versions."""
+        if self.directory is None:
+            return
+        with self.lock:
+            keys = set(self.animations)
+            for name in os.listdir(self.directory):
+                if name.endswith(CACHE_EXTENSION) and name[:-len(CACHE_EXTENSION)] in keys:
+                    continue
+                if name.endswith(CACHE_EXTENSION) or name.endswith(CACHE_EXTENSION + '.tmp'):
+                    try:
+                        os.remove(os.path.join(self.directory, name))
+                        logging.debug("Removed stale animation cache file " + name)
+                    except Exception as e:
+                        logging.warning("Could not remove animation cache file " + name + ": " + str(e))
+
+    def __loadFromDisk(self, key, timeline):
+        if self.directory is None:
+            return timeline.compile()
+        path = os.path.join(self.directory, key + CACHE_EXTENSION)
+        try:
+            return CompiledAnimation.read(path)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.warning("Could not read animation cache file " + path + ": " + str(e))
+        animation = timeline.compile()
+        try:
+            animation.write(path)
+            logging.debug("Stored compiled animation " + key)
+        except Exception as e:
+            logging.warning("Could not write animation cache file " + path + ": " + str(e))
+        return animation
+
+def _checksum(value, checksum):
+    if isinstance(value, (array, bytes)):
+        return zlib.crc32(value, checksum)
+    if isinstance(value, (list, tuple)):
+        for item in value:
+            checksum = _checksum(item, checksum)
+        return checksum
+    checksum = zlib.crc32(repr(getattr(value, '__qualname__', value)).encode(), checksum)
+    if hasattr(value, '__code__'):
+        checksum = _codeChecksum(value.__code__, value.__globals__, checksum, set())
+    return checksum
+
+def _codeChecksum(code, functions, checksum, seen):
+    """Checksum of compiled code, nested code and the module level functions it calls."""
+    checksum = zlib.crc32(code.co_code, checksum)
+    for const in code.co_consts:
+        if isinstance(const, CodeType):
+            checksum = _codeChecksum(const, functions, checksum, seen)
+        else:
+            checksum = zlib.crc32(repr(const).encode(), checksum)
+    for name in code.co_names:
+        function = functions.get(name)
+        if hasattr(function, '__code__') and function not in seen:
+            seen.add(function)
+            checksum = _codeChecksum(function.__code__, function.__globals__, checksum, seen)
+    return checksum
+
+def rainbowCycle(ledCount, brightness, wait_ms=10):
+    """Draw rainbow that uniformly distributes itself across all pixels."""
+    return Timeline('rainbow', ledCount, round(1000 / wait_ms)).batch(rainbowFrames, brightness, wait_ms / 1000.0, ledCount)
+
+def theaterChaseRainbow(ledCount, brightness, wait_ms=50):
+    """Rainbow movie theater light style chaser animation."""
+    return Timeline('theater', ledCount, round(1000 / wait_ms)).sequence(_theaterChaseFrame, 256 * 3, brightness, wheelTable(), ledCount, wait_ms)
+
+def _theaterChaseFrame(index, colors, ledCount, wait_ms):
+    j, q = divmod(index, 3)
+    pixels = array('I', [0] * ledCount)
+    for i in range(0, ledCount - q, 3):
+        pixels[i + q] = colors[(i + j) % 255]
+    return pixels, wait_ms / 1000.0
+
+SKIP_LIGHTS = [[19], [18, 20], [17, 21], [16, 22], [15, 23], [14, 24], [13, 1], [12, 2], [11, 3], [10, 4], [9, 5], [8, 6], [7]]
+
+def skip(ledCount, brightness, invert, trail=6, wait_ms=50):
+    """Left to right or right to left swipe."""
+    return Timeline('skip', ledCount, 1000).sequence(_skipFrame, 12 + trail, brightness, ledCount, invert, trail, wait_ms)
+
+def _skipFrame(index, ledCount, invert, trail, wait_ms):
+    lightsArray = SKIP_LIGHTS[::-1] if invert else SKIP_LIGHTS
+    pixels = array('I', [0] * ledCount)
+    for lights in range(index + 1):
+        if lights <= 12:
+            for light in lightsArray[lights]:
+                if light < ledCount:
+                    pixels[light] = packColor(0, 255, 0)
+        if lights - (trail - 1) >= 0:
+            for light in lightsArray[lights - (trail - 1)]:
+                if light < ledCount:
+                    pixels[light] = 0
+    sleep_multi = abs(index - 7) / 7
+    return pixels, (wait_ms * sleep_multi) / 1000.0
+
+def pulse(ledCount, color, brightness, duration, fps):
+    """Fade in and out once, play it repeatedly for a pulsing light."""
+    pixels = [color] * ledCount
+    return Timeline('pulse', ledCount, fps).fade(pixels, 0, brightness, duration).fade(pixels, brightness, 0, duration)
+
+def flash(ledCount, color, brightness, duration, fps):
+    pixels = [color] * ledCount
+    return Timeline('flash', ledCount, fps).fade(pixels, 0, brightness, duration).fade(pixels, brightness, 0, duration)
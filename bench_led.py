@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+# Measures the CPU cost of composing and pushing one LED frame with the pure Python
+# and the NumPy frame buffer. The strip is replaced by a sink so only our own work is
+# measured, not the DMA transfer.
+
+import time
+from animation import AnimationCache, rainbowCycle, skip
+from framebuffer import FrameBuffer, NumpyFrameBuffer, numpy
+from palette import METER_STEPS, volumeFrames, meterFrames
+
+LED_COUNTS = [24, 144, 300]
+FRAMES = 2000
+BRIGHTNESS = 128
+METER_BRIGHTNESS = 25
+
+class NullStrip():
+    """Takes pixels the way rpi_ws281x does: no item assignment, one plain int per
+    setPixelColor() call. The SWIG wrapper rejects NumPy integers."""
+
+    def setPixelColor(self, pos, color):
+        if type(pos) is not int or type(color) is not int:
+            raise TypeError("in method 'ws2811_led_set', expected int")
+
+    def show(self):
+        pass
+
+def measure(function):
+    """Average seconds per call."""
+    start = time.perf_counter()
+    for i in range(FRAMES):
+        function(i)
+    return (time.perf_counter() - start) / FRAMES
+
+def benchmark(frameBuffer, ledCount):
+    strip = NullStrip()
+    meter = meterFrames(ledCount)
+    volume = volumeFrames(ledCount)
+    cache = AnimationCache()
+    rainbow = cache.load(rainbowCycle(ledCount, BRIGHTNESS))
+    swipe = cache.load(skip(ledCount, BRIGHTNESS, False))
+
+    def meterFrame(i):
+        frameBuffer.draw(meter[(i * 7) % (METER_STEPS * METER_STEPS)], METER_BRIGHTNESS)
+        frameBuffer.push(strip)
+
+    def rainbowFrame(i):
+        frameBuffer.draw(rainbow.frames[i % rainbow.frameCount], BRIGHTNESS)
+        frameBuffer.push(strip)
+
+    def volumeOverMeter(i):
+        frameBuffer.draw(meter[(i * 7) % (METER_STEPS * METER_STEPS)], METER_BRIGHTNESS)
+        frameBuffer.blend(volume[i % len(volume)], BRIGHTNESS - i % BRIGHTNESS, 255 - i % 255)
+        frameBuffer.push(strip)
+
+    def skipOverMeter(i):
+        frameBuffer.draw(meter[(i * 7) % (METER_STEPS * METER_STEPS)], METER_BRIGHTNESS)
+        frameBuffer.blend(swipe.frames[i % swipe.frameCount], BRIGHTNESS, 255, True)
+        frameBuffer.push(strip)
+
+    return [("meter", measure(meterFrame)), ("rainbow", measure(rainbowFrame)),
+            ("volume over meter", measure(volumeOverMeter)), ("skip over meter", measure(skipOverMeter))]
+
+if __name__ == "__main__":
+    backends = [("python", FrameBuffer)]
+    if numpy is not None:
+        backends.append(("numpy", NumpyFrameBuffer))
+    else:
+        print("NumPy is not installed, only measuring the pure Python frame buffer")
+    print("Microseconds per frame, " + str(FRAMES) + " frames each")
+    for ledCount in LED_COUNTS:
+        for name, backend in backends:
+            results = benchmark(backend(ledCount), ledCount)
+            print(str(ledCount).rjust(4) + " LEDs " + name.ljust(7) + "  " + "  ".join(label + ": " + format(seconds * 1000000, '.1f') for label, seconds in results))
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+# Measures the latency from an input to the command arriving at the player, and the event
+# throughput into the handlers Box registers, against the librespot-java stand-in. Inputs
+# are triggered the way Box does: card tap -> play(), button -> next(), encoder detent ->
+# changeVolume(). Latencies include the command queue and the volume coalescing window.
+
+import time
+import logging
+from threading import Event
+from player import Player
+from standin import PlayerStandIn
+
+RUNS = 200
+PAUSE = 0.01 # Seconds between the previous response and the next input, so each one is measured on its own
+EVENT_BURST = 2000
+EVENT_RATES = [None, 1000] # Events per second, None sends them as fast as possible
+EVENT_TYPES = ["trackSeeked", "volumeChanged"]
+RESPONSE_DELAYS = [0, 0.02]
+
+def percentiles(values, percents=(50, 90, 99, 100)):
+    values = sorted(values)
+    return [values[min(len(values) - 1, int(len(values) * percent / 100))] for percent in percents]
+
+def formatLatencies(label, latencies):
+    return label.ljust(30) + "  ".join("p" + str(percent) + " " + format(value * 1000, '.2f').rjust(7) + "ms" for percent, value in zip((50, 90, 99, 100), percentiles(latencies)))
+
+def measure(standIn, trigger, prefix):
+    """Seconds from calling trigger(i) until the stand-in received a command starting with prefix."""
+    arrived = Event()
+    arrival = [0]
+
+    def received(time, path):
+        if path.startswith(prefix):
+            arrival[0] = time
+            arrived.set()
+
+    standIn.onRequest(received)
+    latencies = []
+    for i in range(RUNS):
+        arrived.clear()
+        start = time.monotonic()
+        trigger(i)
+        if not arrived.wait(5):
+            raise RuntimeError("No " + prefix + " command arrived")
+        latencies.append(arrival[0] - start)
+        time.sleep(standIn.responseDelay + PAUSE)
+    standIn.requestListeners.remove(received)
+    return latencies
+
+class EventCounter():
+    """Stands in for a handler Box registers, minus the LED."""
+
+    def __init__(self):
+        self.handled = 0
+        self.last = 0
+
+    def handle(self, event):
+        repr(event)
+        self.handled += 1
+        self.last = time.monotonic()
+
+def eventThroughput(standIn, player, counter, eventType, rate):
+    """Events per second from the stand-in through the websocket into the handler of
+    eventType. Events that never reach it are counted apart: coalesced ones were merged into
+    the latest pending event of their type, the others were dropped from a full queue."""
+    handled = counter.handled
+    merged = player.eventsMerged
+    dropped = player.eventsDropped
+    start = standIn.burst(EVENT_BURST, eventType, rate)
+    timeout = time.monotonic() + 10
+    while counter.handled - handled + player.eventsMerged - merged + player.eventsDropped - dropped < EVENT_BURST and time.monotonic() < timeout:
+        time.sleep(0.01)
+    return counter.handled - handled, player.eventsMerged - merged, player.eventsDropped - dropped, counter.last - start
+
+def benchmark(responseDelay):
+    standIn = PlayerStandIn(port=0, responseDelay=responseDelay).start()
+    connected = Event()
+    player = Player(lambda state: state and connected.set(), port=standIn.port)
+    player.start()
+    if not connected.wait(5):
+        raise RuntimeError("Player did not connect to the stand-in")
+    print("Response delay " + format(responseDelay * 1000, '.0f') + "ms, " + str(RUNS) + " runs each")
+    print("  " + formatLatencies("card tap -> load", measure(standIn, lambda i: player.play("spotify:playlist:bench" + str(i)), "/player/load")))
+    print("  " + formatLatencies("button -> next", measure(standIn, lambda i: player.next(), "/player/next")))
+    print("  " + formatLatencies("encoder -> set-volume", measure(standIn, lambda i: player.changeVolume(1 if i % 2 else -1), "/player/set-volume")))
+    # trackSeeked is handed to the handler one by one, which makes it the real handler
+    # throughput. volumeChanged shows how much of a burst coalescing spares the handler.
+    for eventType in EVENT_TYPES:
+        counter = EventCounter()
+        player.on(eventType, counter.handle)
+        for rate in EVENT_RATES:
+            handled, merged, dropped, seconds = eventThroughput(standIn, player, counter, eventType, rate)
+            label = eventType + " -> handler" + (" (burst)" if rate is None else " (" + str(rate) + "/s)")
+            print("  " + label.ljust(36) + str(handled) + "/" + str(EVENT_BURST) + " handled in " + format(seconds * 1000, '.1f') + "ms, " + format(handled / seconds, '.0f') + " events/s, merged " + str(merged) + ", dropped " + str(dropped))
+    player.cleanup()
+    standIn.stop()
+
+if __name__ == "__main__":
+    # Dropped events would log one warning each and drown the results
+    logging.basicConfig(level=logging.ERROR)
+    for responseDelay in RESPONSE_DELAYS:
+        benchmark(responseDelay)
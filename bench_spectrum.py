@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+
+# Measures how much faster than real time the spectrum analyzer processes PCM for a few
+# block size, overlap and decimation settings. The worst case feeds one hop per call so
+# every block is analyzed. The usual case feeds what the reader gets per update, where
+# only the newest block of each chunk is analyzed.
+
+import time
+from palette import SPECTRUM_BANDS
+from spectrum import SpectrumAnalyzer, CHANNELS, numpy
+
+SAMPLE_RATES = [44100, 48000]
+SETTINGS = [(512, 0.5, 2), (1024, 0.5, 2), (1024, 0.75, 2), (2048, 0.5, 1), (2048, 0.75, 4)]
+SECONDS = 10
+CHUNK_FRAMES = 1470 # What the reader gets per update at 30 updates per second
+
+def testSignal(sampleRate):
+    """Two tones plus noise, interleaved 16 bit stereo."""
+    t = numpy.arange(sampleRate * SECONDS) / sampleRate
+    signal = 0.3 * numpy.sin(2 * numpy.pi * 110 * t) + 0.2 * numpy.sin(2 * numpy.pi * 3000 * t) + 0.05 * numpy.random.randn(len(t))
+    return (numpy.repeat(signal, CHANNELS) * 32767).astype('<i2').tobytes()
+
+def measure(analyzer, pcm, chunkFrames):
+    """Seconds of CPU time for all chunks."""
+    chunk = chunkFrames * CHANNELS * 2
+    start = time.process_time()
+    for offset in range(0, len(pcm), chunk):
+        analyzer.add(pcm[offset:offset + chunk])
+    return time.process_time() - start
+
+if __name__ == "__main__":
+    if numpy is None:
+        raise SystemExit("The spectrum analyzer needs NumPy")
+    print("Real time factor for " + str(SECONDS) + "s of audio, " + str(SPECTRUM_BANDS) + " bands. Above 1 keeps up")
+    for sampleRate in SAMPLE_RATES:
+        pcm = testSignal(sampleRate)
+        for blockSize, overlap, decimation in SETTINGS:
+            analyzer = SpectrumAnalyzer(SPECTRUM_BANDS, sampleRate, blockSize, overlap, decimation)
+            worst = measure(analyzer, pcm, analyzer.hop * decimation)
+            usual = measure(SpectrumAnalyzer(SPECTRUM_BANDS, sampleRate, blockSize, overlap, decimation), pcm, CHUNK_FRAMES)
+            blocksPerSecond = sampleRate / decimation / analyzer.hop
+            print(str(sampleRate).rjust(5) + " Hz  block " + str(blockSize).rjust(4) + "  overlap " + format(overlap, '.2f') + "  decimation " + str(decimation) +
+                  "  every block (" + format(blocksPerSecond, '.0f').rjust(3) + "/s): " + format(SECONDS / worst, '.0f').rjust(5) + "x" +
+                  "  per update: " + format(SECONDS / usual, '.0f').rjust(5) + "x  " + ("ok" if worst < SECONDS else "TOO SLOW"))
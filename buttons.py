@@ -4,6 +4,7 @@ from button import *
 import RPi.GPIO as GPIO
 import logging
 import time
+from scheduler import Deadline
 from threading import Event, Thread
 
 PUSH_BUTTON_BLINK_COUNT = 5
@@ -77,32 +78,34 @@ class ButtonManager():
         self.clearNext()
 
     def __blinkPrevButton(self, times, duration, delay=0):
-        flag = self.prevButtonCancelEvent.wait(delay)
+        deadline = Deadline()
+        flag = deadline.wait(self.prevButtonCancelEvent, delay)
         if flag:
             return
         for i in range(times):
             GPIO.output(PREV_BUTTON_PIN, 1)
-            flag = self.prevButtonCancelEvent.wait(duration)
+            flag = deadline.wait(self.prevButtonCancelEvent, duration)
             if flag:
                 GPIO.output(PREV_BUTTON_PIN, 0)
                 return
             GPIO.output(PREV_BUTTON_PIN, 0)
-            flag = self.prevButtonCancelEvent.wait(duration)
+            flag = deadline.wait(self.prevButtonCancelEvent, duration)
             if flag:
                 return
 
     def __blinkNextButton(self, times, duration, delay=0):
-        flag = self.nextButtonCancelEvent.wait(delay)
+        deadline = Deadline()
+        flag = deadline.wait(self.nextButtonCancelEvent, delay)
         if flag:
             return
         for i in range(times):
             GPIO.output(NEXT_BUTTON_PIN, 1)
-            flag = self.nextButtonCancelEvent.wait(duration)
+            flag = deadline.wait(self.nextButtonCancelEvent, duration)
             if flag:
                 GPIO.output(NEXT_BUTTON_PIN, 0)
                 return
             GPIO.output(NEXT_BUTTON_PIN, 0)
-            flag = self.nextButtonCancelEvent.wait(duration)
+            flag = deadline.wait(self.nextButtonCancelEvent, duration)
             if flag:
                 return
 
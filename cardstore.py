@@ -0,0 +1,321 @@
+#!/usr/bin/env python
+
+import os
+import glob
+import json
+import time
+import sqlite3
+import logging
+from threading import Lock
+
+JSON_FILE_NAME = 'database.json'
+SQLITE_FILE_NAME = 'database.sqlite'
+JOURNAL_SUFFIX = '.journal'
+MIGRATED_SUFFIX = '.migrated' # The JSON database as it was when the SQLite store took over
+IMPORTED_SUFFIX = '.imported' # The last database.json pushed to the box since then
+CORRUPT_SUFFIX = '.corrupt'
+COMPACT_AFTER = 100 # Journal entries before they are folded into the snapshot
+
+def writeFileAtomically(path, data):
+    """Replace path with data so that after a power cut it holds either the old or the new content."""
+    temporary = path + '.tmp'
+    with open(temporary, 'w') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+    syncDirectory(path)
+
+def syncDirectory(path):
+    """Persist a rename or a newly created file in the directory of path."""
+    directory = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+
+def moveAside(path, suffix):
+    """Rename path to path + suffix and a time stamp, never over an earlier one. Returns the new name."""
+    name = path + suffix + '-' + time.strftime('%Y%m%d-%H%M%S')
+    target = name
+    attempt = 1
+    while os.path.exists(target):
+        attempt += 1
+        target = name + '-' + str(attempt)
+    os.replace(path, target)
+    syncDirectory(path)
+    return target
+
+class JsonCardStore():
+    """All mappings in memory. The snapshot in path is only ever replaced with an atomic
+    rename. New mappings are appended to a journal next to it and folded into the snapshot
+    every COMPACT_AFTER entries. A reload builds a new dict and swaps it in, so lookups see
+    either the old or the new mappings, never a mix. A readOnly store never writes, it
+    only tells with readable whether the snapshot could be parsed."""
+
+    def __init__(self, path=JSON_FILE_NAME, readOnly=False):
+        self.path = path
+        self.readOnly = readOnly
+        self.readable = True
+        self.journalPath = path + JOURNAL_SUFFIX
+        self.journalEntries = 0
+        self.journalTorn = False
+        # Identity of the files as last read or written, to tell changes of others from ours
+        self.fingerprint = None
+        self.writeLock = Lock()
+        self.load()
+
+    def load(self):
+        with self.writeLock:
+            self.fingerprint = self.__fingerprint()
+            self.database = self.__loadSnapshot()
+            self.readable = self.database is not None
+            if self.database is None:
+                self.database = {}
+                if not self.readOnly:
+                    # Keep the library for recovery, compacting would replace it with what little the journal has
+                    aside = moveAside(self.path, CORRUPT_SUFFIX)
+                    self.fingerprint = self.__fingerprint()
+                    logging.error("Moved unreadable database file to " + aside + ". Creating new database")
+            self.journalEntries, self.journalTorn = self.__replayJournal(self.database)
+            if not self.readOnly and (self.journalTorn or self.journalEntries >= COMPACT_AFTER):
+                self.__compact()
+
+    def reload(self, swap):
+        """Read the files again if someone else changed them. The file is the whole database,
+        mappings missing from it are removed. The new mappings become visible when this calls
+        swap(changed, switch), which must call switch(). Returns the UIDs whose playlist changed."""
+        with self.writeLock:
+            fingerprint = self.__fingerprint()
+            if fingerprint == self.fingerprint:
+                return set()
+            database = self.__loadSnapshot()
+            if database is None:
+                # Probably still being written, the next change event tries again
+                return set()
+            entries, torn = self.__replayJournal(database)
+            changed = set(uid for uid in database.keys() | self.database.keys() if database.get(uid) != self.database.get(uid))
+
+            def switch():
+                self.database = database
+            swap(changed, switch)
+            self.journalEntries, self.journalTorn = entries, torn
+            self.fingerprint = fingerprint
+            return changed
+
+    def watchedPaths(self):
+        return [self.path, self.journalPath]
+
+    def __fingerprint(self):
+        fingerprint = []
+        for path in (self.path, self.journalPath):
+            try:
+                stat = os.stat(path)
+                fingerprint.append((stat.st_ino, stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                fingerprint.append(None)
+        return tuple(fingerprint)
+
+    def __loadSnapshot(self):
+        """The snapshot as a dict, empty if there is none yet and None if it can not be read."""
+        try:
+            with open(self.path, 'r') as db:
+                database = json.load(db)
+            logging.info("Successfully loaded database file")
+            return database
+        except FileNotFoundError:
+            logging.info("No database file yet")
+            return {}
+        except Exception as e:
+            logging.error("Could not load database file: " + str(e))
+            return None
+
+    def __replayJournal(self, database):
+        """Apply the journal on top of the snapshot. Returns the number of entries applied and
+        whether the journal ended with an incomplete entry, cut off by a power loss."""
+        entries = 0
+        try:
+            with open(self.journalPath, 'r') as journal:
+                for line in journal:
+                    try:
+                        if not line.endswith('\n'):
+                            raise ValueError("entry is incomplete")
+                        entry = json.loads(line)
+                        database[entry['uid']] = entry['playlist']
+                    except (ValueError, KeyError, TypeError) as e:
+                        logging.warning("Ignoring database journal from entry " + str(entries + 1) + " on: " + str(e))
+                        return entries, True
+                    entries += 1
+        except FileNotFoundError:
+            pass
+        if entries > 0:
+            logging.info("Replayed " + str(entries) + " database journal entries")
+        return entries, False
+
+    def __compact(self):
+        """Write the whole database as the new snapshot, then start an empty journal. A power
+        cut in between only replays entries that are already in the snapshot."""
+        writeFileAtomically(self.path, json.dumps(self.database))
+        with open(self.journalPath, 'w') as journal:
+            os.fsync(journal.fileno())
+        self.journalEntries = 0
+        self.journalTorn = False
+        self.fingerprint = self.__fingerprint()
+        logging.info("Successfully saved database file")
+
+    def get(self, uid):
+        return self.database.get(uid)
+
+    def set(self, uid, playlist):
+        with self.writeLock:
+            self.database[uid] = playlist
+            if self.journalTorn:
+                # A torn last entry would swallow the one appended now
+                self.__compact()
+                return
+            with open(self.journalPath, 'a') as journal:
+                journal.write(json.dumps({'uid': uid, 'playlist': playlist}) + '\n')
+                journal.flush()
+                os.fsync(journal.fileno())
+            self.journalEntries += 1
+            if self.journalEntries == 1:
+                # The journal may have just been created
+                syncDirectory(self.journalPath)
+            if self.journalEntries >= COMPACT_AFTER:
+                self.__compact()
+            else:
+                self.fingerprint = self.__fingerprint()
+
+    def items(self):
+        return list(self.database.items())
+
+    def close(self):
+        pass
+
+class SqliteCardStore():
+    """Mappings in an SQLite table keyed by UID, so nothing is loaded up front and a lookup
+    is a single index probe. Existing JSON databases are imported on first use, and so is a
+    database.json pushed to the box later on. Lookups have a connection of their own, in WAL
+    mode they read the last commit while a write is in progress."""
+
+    def __init__(self, path=SQLITE_FILE_NAME, migrateFrom=JSON_FILE_NAME):
+        self.path = path
+        self.migrateFrom = migrateFrom
+        # Writers share this connection
+        self.lock = Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        # Commits survive a power cut, not just a crash of the process
+        self.connection.execute("PRAGMA synchronous=FULL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS cards (uid TEXT PRIMARY KEY, playlist TEXT NOT NULL) WITHOUT ROWID")
+        self.readLock = Lock()
+        self.reader = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        # Changes when another connection commits, ours do not count
+        self.dataVersion = self.__dataVersion()
+        if migrateFrom is not None and os.path.exists(migrateFrom):
+            self.migrate(migrateFrom)
+
+    def load(self):
+        # Every lookup reads the file, there is nothing to reload
+        pass
+
+    def reload(self, swap):
+        """Import a database.json that showed up, its mappings replace the ones in the table.
+        Unlike with JsonCardStore, the file is not the whole database: cards missing from it,
+        like the ones programmed on the box, are kept. The import is committed in
+        swap(changed, switch), see JsonCardStore.reload(). Returns the UIDs whose playlist
+        changed, or None if another process wrote to the table."""
+        changed = set()
+        if self.migrateFrom is not None and os.path.exists(self.migrateFrom):
+            changed = self.migrate(self.migrateFrom, overwrite=True, swap=swap)
+        dataVersion = self.__dataVersion()
+        if dataVersion != self.dataVersion:
+            self.dataVersion = dataVersion
+            return None
+        return changed
+
+    def watchedPaths(self):
+        paths = [self.path, self.path + "-wal"]
+        if self.migrateFrom is not None:
+            paths.append(self.migrateFrom)
+        return paths
+
+    def __dataVersion(self):
+        with self.lock:
+            return self.connection.execute("PRAGMA data_version").fetchone()[0]
+
+    def migrate(self, jsonPath, overwrite=False, swap=None):
+        """Import the mappings of a JsonCardStore in one transaction, then move its files aside
+        so they are not imported again. Unless overwrite is set, mappings already in the table
+        win. Only entries that differ are written, the transaction is committed in
+        swap(changed, switch) if given. Returns the UIDs of the entries written."""
+        source = JsonCardStore(jsonPath, readOnly=True)
+        if not source.readable:
+            logging.error("Not importing " + jsonPath + " until it can be read")
+            return set()
+        # Compared one lookup at a time, so card taps are served in between
+        entries = []
+        for uid, playlist in source.items():
+            current = self.get(uid)
+            if current is None or (overwrite and current != playlist):
+                entries.append((uid, playlist))
+        changed = set(uid for uid, playlist in entries)
+        with self.lock:
+            self.connection.execute("BEGIN")
+            try:
+                self.connection.executemany("INSERT OR REPLACE INTO cards (uid, playlist) VALUES (?, ?)", entries)
+                if swap is not None:
+                    swap(changed, self.__commit)
+                else:
+                    self.__commit()
+            except BaseException:
+                if self.connection.in_transaction:
+                    self.connection.execute("ROLLBACK")
+                raise
+        self.__backUp(jsonPath, source.journalPath)
+        logging.info("Migrated " + str(len(entries)) + " entries from " + jsonPath + " to " + self.path)
+        return changed
+
+    def __backUp(self, jsonPath, journalPath):
+        """Move imported files out of the way. The first import is kept for good, of later
+        ones only the most recent, so pushing a database.json over and over does not fill the disk."""
+        if not glob.glob(glob.escape(jsonPath + MIGRATED_SUFFIX) + '-*'):
+            for path in (jsonPath, journalPath):
+                if os.path.exists(path):
+                    moveAside(path, MIGRATED_SUFFIX)
+            return
+        for path in (jsonPath, journalPath):
+            backup = path + IMPORTED_SUFFIX
+            if os.path.exists(path):
+                os.replace(path, backup)
+            elif os.path.exists(backup):
+                # Belongs to an earlier import
+                os.remove(backup)
+        syncDirectory(jsonPath)
+
+    def __commit(self):
+        self.connection.execute("COMMIT")
+
+    def get(self, uid):
+        with self.readLock:
+            row = self.reader.execute("SELECT playlist FROM cards WHERE uid = ?", (uid,)).fetchone()
+        return row[0] if row is not None else None
+
+    def set(self, uid, playlist):
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO cards (uid, playlist) VALUES (?, ?)", (uid, playlist))
+
+    def items(self):
+        with self.readLock:
+            return self.reader.execute("SELECT uid, playlist FROM cards").fetchall()
+
+    def close(self):
+        with self.readLock:
+            self.reader.close()
+        with self.lock:
+            self.connection.close()
+
+STORES = {
+    "json": JsonCardStore,
+    "sqlite": SqliteCardStore,
+}
@@ -1,33 +1,146 @@
 #!/usr/bin/env python
 
-import json
+import os
+import time
 import logging
+from collections import OrderedDict
+from threading import Thread, Event, Lock
+from watchdog.observers import Observer
+from watchdog.events import FileSystemEventHandler, EVENT_TYPE_MODIFIED, EVENT_TYPE_CREATED, EVENT_TYPE_MOVED, EVENT_TYPE_DELETED
+from cardstore import STORES
 
-DB_FILE_NAME = 'database.json'
+DB_BACKEND = 'sqlite'
+CACHE_SIZE = 64 # Playlists of recently tapped cards kept in memory, 0 turns the cache off
+RELOAD_DELAY = 0.5 # Seconds to let a burst of file changes settle before reloading
+MISSING = object() # Not in the cache, None is a cached lookup of an unknown card
 
 class Database():
+    """Card UID to playlist URI mappings in a card store from cardstore.STORES. The SQLite
+    store imports an existing database.json on first start. With watch set, changes others
+    make to the files of the store are picked up while running: a changed database.json
+    replaces the JSON store, while the SQLite store imports it and keeps cards missing from it."""
 
-    def __init__(self):
-        self.refreshDatabase()
+    def __init__(self, backend=DB_BACKEND, cacheSize=CACHE_SIZE, watch=True, **options):
+        self.store = STORES[backend](**options)
+        self.cacheSize = cacheSize
+        # Only changed under cacheLock, which is never held while the store reads or writes.
+        # Lookups do not take it, a single get() of the dict is atomic.
+        self.cache = OrderedDict()
+        self.cacheLock = Lock()
+        # Bumped whenever the store changes, a lookup only caches what it read if it was not
+        self.generation = 0
+        self.switching = 0
+        self.observer = None
+        self.changedEvent = Event()
+        self.stopped = False
+        if watch:
+            self.__watch()
+
+    def __watch(self):
+        logging.info("Watching file system for database changes")
+        paths = [os.path.abspath(path) for path in self.store.watchedPaths()]
+        self.observer = Observer()
+        # Watch the directories, files replaced by a rename would no longer be watched
+        for directory in set(os.path.dirname(path) for path in paths):
+            self.observer.schedule(DatabaseEventHandler(paths, self.changedEvent.set), directory)
+        self.observer.start()
+        Thread(target=self.__reloadOnChange, daemon=True).start()
+
+    def __reloadOnChange(self):
+        while True:
+            self.changedEvent.wait()
+            time.sleep(RELOAD_DELAY)
+            if self.stopped:
+                return
+            self.changedEvent.clear()
+            try:
+                self.refreshDatabase()
+            except Exception as e:
+                logging.error("Could not reload database: " + str(e))
 
     def refreshDatabase(self):
+        """Apply the changes others made to the store. Lookups keep seeing the previous
+        mappings until the store swapped in the new ones."""
+        changed = self.store.reload(self.__swap)
+        if changed is None:
+            with self.cacheLock:
+                self.generation += 1
+                self.cache.clear()
+            logging.info("Database was changed from outside. Cleared cached playlists")
+        elif changed:
+            logging.info("Reloaded " + str(len(changed)) + " changed database entries")
+
+    def __swap(self, changed, switch):
+        """Called by the store to make reloaded mappings visible, switch() may commit to disk.
+        Stale cached playlists are dropped first and nothing read until switch() returned is
+        cached, so no lookup sees them next to new ones. Lookups are not blocked meanwhile."""
+        with self.cacheLock:
+            self.switching += 1
+            self.generation += 1
+            for uid in changed:
+                self.cache.pop(uid, None)
         try:
-            with open(DB_FILE_NAME, 'r') as db:
-                self.database = json.load(db)
-            logging.info("Successfully loaded database file")
-        except:
-            self.database = {}
-            logging.info("Could not load database file. Creating new database")
-    
+            switch()
+        finally:
+            with self.cacheLock:
+                self.switching -= 1
+                self.generation += 1
+
     def readPlaylist(self, uid):
+        playlist = self.cache.get(uid, MISSING)
+        if playlist is not MISSING:
+            self.__touch(uid)
+            return playlist
+        generation = self.generation
         try:
-            return self.database[uid]
-        except:
+            playlist = self.store.get(uid)
+        except Exception as e:
+            logging.error("Could not read database entry for " + str(uid) + ": " + str(e))
             return None
+        with self.cacheLock:
+            # Whatever changed the store in the meantime may have replaced this playlist
+            if generation == self.generation and not self.switching:
+                self.__cache(uid, playlist)
+        return playlist
 
     def setPlaylist(self, uid, playlist):
         logging.info("Adding entry for " + uid + " to database")
-        self.database[uid] = playlist
-        with open(DB_FILE_NAME, 'w') as db:
-            json.dump(self.database, db)
-            logging.info("Successfully saved database file")
\ No newline at end of file
+        # Cached again by the next lookup, caching it here could race with a reload of the same card
+        self.__swap({uid}, lambda: self.store.set(uid, playlist))
+        logging.info("Successfully saved database entry")
+
+    def __touch(self, uid):
+        """Mark a cached playlist as recently used, unless that would mean waiting for the lock."""
+        if self.cacheLock.acquire(blocking=False):
+            try:
+                if uid in self.cache:
+                    self.cache.move_to_end(uid)
+            finally:
+                self.cacheLock.release()
+
+    def __cache(self, uid, playlist):
+        if self.cacheSize > 0:
+            self.cache[uid] = playlist
+            if len(self.cache) > self.cacheSize:
+                self.cache.popitem(last=False)
+
+    def cleanup(self):
+        if self.observer is not None:
+            self.observer.stop()
+            self.stopped = True
+            self.changedEvent.set()
+        self.store.close()
+
+class DatabaseEventHandler(FileSystemEventHandler):
+
+    def __init__(self, paths, callback):
+        self.paths = paths
+        self.callback = callback
+
+    def on_any_event(self, event):
+        # Opening and reading the files, which reloading does, is not a change
+        if event.is_directory or event.event_type not in [EVENT_TYPE_MODIFIED, EVENT_TYPE_CREATED, EVENT_TYPE_MOVED, EVENT_TYPE_DELETED]:
+            return
+        if event.src_path in self.paths or getattr(event, "dest_path", None) in self.paths:
+            logging.debug("Caught event: " + event.event_type + " for path: " + event.src_path)
+            self.callback()
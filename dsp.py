@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+
+import math
+import struct
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+FRAME = struct.Struct('<HH') # Left and right channel level as written to the meter pipe
+RMS_WINDOW = 32              # Number of recent frames the RMS level is computed over
+ATTACK_TIME = 0.02           # Seconds for the envelope to follow ~63% of a rising level
+RELEASE_TIME = 0.25          # Seconds for the envelope to follow ~63% of a falling level
+PEAK_HOLD_TIME = 1.0         # Seconds a peak stays before it starts to fall
+PEAK_DECAY = 60              # Percent per second a peak falls after the hold time
+SILENCE_LEVEL = 0.5          # Envelope and peak are considered zero below this percentage
+FULL_SCALE_LEVEL = 45        # Raw level shown as 100% without auto gain, at full master volume
+GAIN_WINDOW = 2048           # Number of recent raw levels the auto gain histogram covers
+GAIN_BINS = 256              # Histogram bins, one per raw level. Louder levels go into the last bin
+GAIN_PERCENTILE = 95         # The raw level at this percentile ...
+GAIN_TARGET = 90             # ... is shown at this percentage
+GAIN_MIN_SAMPLES = 64        # Levels needed before the histogram is trusted over the seed
+GAIN_NOISE_FLOOR = 1         # Raw levels below this are silence and do not count
+GAIN_MIN_REFERENCE = 2.0     # Lower bound of the reference level, so noise is not blown up
+GAIN_ADJUST_TIME = 2.0       # Seconds for the reference to follow ~63% of a change
+GAIN_SETTLE_TIME = 0.5       # Seconds without volume changes before the histogram starts over
+
+class LevelRing():
+    """Fixed size ring buffer of the most recent raw levels of both channels."""
+
+    def __init__(self, size=RMS_WINDOW):
+        self.size = size
+        self.index = 0
+        self.left = array('d', [0.0] * size)
+        self.right = array('d', [0.0] * size)
+        self.leftSquares = 0.0
+        self.rightSquares = 0.0
+
+    def add(self, block):
+        """Add a block of complete frames in pipe format."""
+        for left, right in FRAME.iter_unpack(block):
+            self.leftSquares += left * left - self.left[self.index] * self.left[self.index]
+            self.rightSquares += right * right - self.right[self.index] * self.right[self.index]
+            self.left[self.index] = left
+            self.right[self.index] = right
+            self.index += 1
+            if self.index == self.size:
+                self.index = 0
+                # Running sums drift with floating point errors, start over once per round
+                self.leftSquares = sum(level * level for level in self.left)
+                self.rightSquares = sum(level * level for level in self.right)
+
+    def rms(self):
+        return math.sqrt(max(0.0, self.leftSquares) / self.size), math.sqrt(max(0.0, self.rightSquares) / self.size)
+
+class NumpyLevelRing():
+    """Same as LevelRing, but copies whole blocks of frames at once."""
+
+    def __init__(self, size=RMS_WINDOW):
+        self.size = size
+        self.index = 0
+        self.levels = numpy.zeros((size, 2), dtype=numpy.float64)
+
+    def add(self, block):
+        frames = numpy.frombuffer(block, dtype='<u2').reshape(-1, 2)
+        if len(frames) >= self.size:
+            self.levels[:] = frames[-self.size:]
+            self.index = 0
+            return
+        end = self.index + len(frames)
+        if end <= self.size:
+            self.levels[self.index:end] = frames
+        else:
+            split = self.size - self.index
+            self.levels[self.index:] = frames[:split]
+            self.levels[:end - self.size] = frames[split:]
+        self.index = end % self.size
+
+    def rms(self):
+        left, right = numpy.sqrt(numpy.mean(numpy.square(self.levels), axis=0))
+        return float(left), float(right)
+
+class Envelope():
+    """Attack/release smoothing with peak hold for one channel."""
+
+    def __init__(self, attack=ATTACK_TIME, release=RELEASE_TIME, peakHold=PEAK_HOLD_TIME, peakDecay=PEAK_DECAY):
+        self.attack = attack
+        self.release = release
+        self.peakHold = peakHold
+        self.peakDecay = peakDecay
+        self.level = 0.0
+        self.peak = 0.0
+        self.peakAge = 0.0
+
+    def update(self, target, elapsed):
+        time = self.attack if target > self.level else self.release
+        self.level += (target - self.level) * (1 - math.exp(-elapsed / time))
+        if self.level >= self.peak:
+            self.peak = self.level
+            self.peakAge = 0.0
+        else:
+            self.peakAge += elapsed
+            if self.peakAge > self.peakHold:
+                self.peak = max(self.level, self.peak - self.peakDecay * elapsed)
+
+    def isSilent(self):
+        return self.level < SILENCE_LEVEL and self.peak < SILENCE_LEVEL
+
+class AutoGain():
+    """Auto ranging scale for raw levels. A rolling histogram of the most recent levels
+    tracks a percentile with a cursor that is moved as levels come and go, so each level
+    costs O(1) instead of sorting the window. The reference level follows that percentile
+    slowly, so the meter does not pump with every loud passage."""
+
+    def __init__(self, window=GAIN_WINDOW, percentile=GAIN_PERCENTILE):
+        self.window = window
+        self.percentile = percentile
+        self.ring = array('B', [0] * window)
+        self.counts = array('I', [0] * GAIN_BINS)
+        self.index = 0
+        self.filled = 0
+        # Histogram bin holding the percentile and the number of levels in the bins below it
+        self.cursor = 0
+        self.below = 0
+        # Not clamped to GAIN_MIN_REFERENCE, so scaling it with the volume can be undone
+        self.reference = float(FULL_SCALE_LEVEL)
+        self.volume = None
+        # Seconds until the histogram starts over after a volume change, None if none is pending
+        self.settle = None
+
+    def add(self, block):
+        """Add a block of complete frames in pipe format. Both channels count."""
+        for left, right in FRAME.iter_unpack(block):
+            self.__addLevel(left)
+            self.__addLevel(right)
+
+    def __addLevel(self, level):
+        if level < GAIN_NOISE_FLOOR:
+            return
+        level = min(level, GAIN_BINS - 1)
+        if self.filled == self.window:
+            oldest = self.ring[self.index]
+            self.counts[oldest] -= 1
+            if oldest < self.cursor:
+                self.below -= 1
+        else:
+            self.filled += 1
+        self.ring[self.index] = level
+        self.counts[level] += 1
+        if level < self.cursor:
+            self.below += 1
+        self.index += 1
+        if self.index == self.window:
+            self.index = 0
+        self.__moveCursor()
+
+    def __moveCursor(self):
+        # Each level moves the rank and the count below the cursor by at most one
+        rank = self.filled * self.percentile // 100
+        while self.below > rank:
+            self.cursor -= 1
+            self.below -= self.counts[self.cursor]
+        while self.below + self.counts[self.cursor] <= rank and self.cursor < GAIN_BINS - 1:
+            self.below += self.counts[self.cursor]
+            self.cursor += 1
+
+    def __clear(self):
+        for i in range(GAIN_BINS):
+            self.counts[i] = 0
+        self.index = 0
+        self.filled = 0
+        self.cursor = 0
+        self.below = 0
+
+    def level(self):
+        """Raw level at the percentile, None until enough levels arrived."""
+        return self.cursor if self.filled >= GAIN_MIN_SAMPLES else None
+
+    def setVolume(self, volume):
+        """Seed the reference from the player volume in percent. Levels scale with the
+        volume, so the reference jumps along. The histogram starts over once the volume
+        stopped changing for GAIN_SETTLE_TIME, every encoder detent sends a change."""
+        if volume <= 0:
+            return
+        if self.volume is None:
+            self.reference = FULL_SCALE_LEVEL * volume / 100
+        else:
+            self.reference = self.reference * volume / self.volume
+        self.volume = volume
+        self.settle = GAIN_SETTLE_TIME
+
+    def update(self, elapsed):
+        """Move the reference towards the current percentile and return the scale that
+        converts raw levels to percent."""
+        if self.settle is not None:
+            # Levels of the old volume are still in the histogram
+            self.settle -= elapsed
+            if self.settle <= 0:
+                self.settle = None
+                self.__clear()
+        else:
+            level = self.level()
+            if level is not None:
+                self.reference += (level - self.reference) * (1 - math.exp(-elapsed / GAIN_ADJUST_TIME))
+        return GAIN_TARGET / max(GAIN_MIN_REFERENCE, self.reference)
+
+class LevelProcessor():
+    """Turns raw meter frames into smooth levels: RMS over a ring buffer of recent frames,
+    followed by an attack/release envelope and peak hold per channel."""
+
+    def __init__(self, window=RMS_WINDOW):
+        self.ring = NumpyLevelRing(window) if numpy is not None else LevelRing(window)
+        self.left = Envelope()
+        self.right = Envelope()
+
+    def add(self, block):
+        self.ring.add(block)
+
+    def process(self, elapsed, scale, stale=False):
+        """Advance the envelopes by elapsed seconds. scale converts raw levels to percent.
+        If stale, no frames arrived for a while and the levels fall towards zero.
+        Returns left, right, left peak and right peak in percent."""
+        left, right = (0.0, 0.0) if stale else self.ring.rms()
+        self.left.update(left * scale, elapsed)
+        self.right.update(right * scale, elapsed)
+        return self.left.level, self.right.level, self.left.peak, self.right.peak
+
+    def isSilent(self):
+        return self.left.isSilent() and self.right.isSilent()
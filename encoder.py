@@ -3,17 +3,25 @@
 # Class to monitor a rotary encoder and update a value.  You can either read the value when you need it, by calling getValue(), or
 # you can configure a callback which will be called whenever the value changes.
 
+import time
 import RPi.GPIO as GPIO
 
+ACCELERATION_INTERVAL = 0.1 # Detents closer together than this in seconds count as a fast turn
+MAX_STEPS = 4               # Largest step size of a fast turn
+
 class Encoder:
 
-    def __init__(self, leftPin, rightPin, callback=None):
+    def __init__(self, leftPin, rightPin, callback=None, acceleration=False):
         self.leftPin = leftPin
         self.rightPin = rightPin
         self.value = 0
         self.state = '00'
         self.direction = None
         self.callback = callback
+        # With acceleration, a fast turn moves the value by more than 1 per detent
+        self.acceleration = acceleration
+        self.lastDetent = None
+        self.lastDirection = None
         GPIO.setup(self.leftPin, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
         GPIO.setup(self.rightPin, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
         GPIO.add_event_detect(self.leftPin, GPIO.BOTH, callback=self.transitionOccurred)  
@@ -35,18 +43,14 @@ class Encoder:
                 self.direction = "R"
             elif newState == "00": # Turned left 1
                 if self.direction == "L":
-                    self.value = self.value - 1
-                    if self.callback is not None:
-                        self.callback(self.value, self.direction)
+                    self.__turned()
 
         elif self.state == "10": # R3 or L1
             if newState == "11": # Turned left 1
                 self.direction = "L"
             elif newState == "00": # Turned right 1
                 if self.direction == "R":
-                    self.value = self.value + 1
-                    if self.callback is not None:
-                        self.callback(self.value, self.direction)
+                    self.__turned()
 
         else: # self.state == "11"
             if newState == "01": # Turned left 1
@@ -55,15 +59,31 @@ class Encoder:
                 self.direction = "R"
             elif newState == "00": # Skipped an intermediate 01 or 10 state, but if we know direction then a turn is complete
                 if self.direction == "L":
-                    self.value = self.value - 1
-                    if self.callback is not None:
-                        self.callback(self.value, self.direction)
+                    self.__turned()
                 elif self.direction == "R":
-                    self.value = self.value + 1
-                    if self.callback is not None:
-                        self.callback(self.value, self.direction)
+                    self.__turned()
                 
         self.state = newState
 
+    def __turned(self):
+        """A detent was completed in self.direction."""
+        steps = self.__steps()
+        self.value = self.value + (steps if self.direction == "R" else -steps)
+        if self.callback is not None:
+            self.callback(self.value, self.direction, steps)
+
+    def __steps(self):
+        if not self.acceleration:
+            return 1
+        now = time.monotonic()
+        interval = None if self.lastDetent is None else now - self.lastDetent
+        reversed = self.direction != self.lastDirection
+        self.lastDetent = now
+        self.lastDirection = self.direction
+        if interval is None or interval >= ACCELERATION_INTERVAL or reversed:
+            return 1
+        # The faster the turn, the bigger the step
+        return min(MAX_STEPS, 1 + int(ACCELERATION_INTERVAL / max(interval, 0.001)) // 2)
+
     def getValue(self):
         return self.value
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+import io
+import os
+import stat
+import logging
+import select
+
+class FifoReader():
+    """Non-blocking reader for a named pipe of fixed size frames, shared by the meters.
+    Regular files work as well, they end instead of waiting for a new writer. Reads reuse
+    one buffer, bytes of an incomplete frame stay at its start."""
+
+    def __init__(self, path, bufferSize, frameSize):
+        self.path = path
+        self.frameSize = frameSize
+        self.isPipe = stat.S_ISFIFO(os.stat(path).st_mode)
+        self.buffer = bytearray(bufferSize)
+        self.view = memoryview(self.buffer)
+        self.pending = 0
+        # Written to by wake() to interrupt wait()
+        self.wakeupRead, self.wakeupWrite = os.pipe()
+        self.poller = select.poll()
+        self.poller.register(self.wakeupRead, select.POLLIN)
+        self.__open()
+
+    def __open(self):
+        self.fd = os.open(self.path, os.O_RDONLY | os.O_NONBLOCK)
+        self.reader = io.FileIO(self.fd, 'rb', closefd=False)
+        self.pending = 0
+        self.poller.register(self.fd, select.POLLIN)
+
+    def reopen(self):
+        """ Once the writer closed the pipe, poll() reports POLLHUP until a new writer
+        shows up. Reopening resets that, so we can block until there is new data. """
+        self.poller.unregister(self.fd)
+        os.close(self.fd)
+        self.__open()
+
+    def flush(self):
+        try:
+            while self.reader.readinto(self.view):
+                pass
+        except Exception as e:
+            logging.warning(e)
+        self.pending = 0
+
+    def wake(self):
+        """ Make a wait() in another thread return False. """
+        os.write(self.wakeupWrite, b'\0')
+
+    def wait(self, timeout=None):
+        """ Block until the pipe has data, wake() was called or the timeout in seconds
+        passed. Returns True for data, False when woken up and None on timeout. """
+        while True:
+            events = self.poller.poll(None if timeout is None else timeout * 1000)
+            if not events:
+                return None
+            for fd, event in events:
+                if fd == self.wakeupRead:
+                    return False
+                if event & select.POLLIN:
+                    return True
+            # Writer is gone: the audio pipeline stopped
+            logging.debug("Writer of " + self.path + " disconnected. Waiting for a new one")
+            self.reopen()
+
+    def read(self, consume, limit=None):
+        """ Read up to limit buffers, everything available if None, and call consume(block)
+        with every block of complete frames in arrival order. Returns True if complete
+        frames were read, False if not and None once a regular file has been read to the end. """
+        received = False
+        while limit is None or limit > 0:
+            try:
+                count = self.reader.readinto(self.view[self.pending:])
+            except OSError as e:
+                logging.warning(e)
+                break
+            if count == 0 and not self.isPipe:
+                return None
+            if not count:
+                # None: no more data for now, 0: the writer is gone
+                break
+            available = self.pending + count
+            end = available - available % self.frameSize
+            if end > 0:
+                consume(self.view[:end])
+                received = True
+            # Move an incomplete frame to the front so frames stay aligned
+            self.pending = available - end
+            if self.pending:
+                self.buffer[:self.pending] = self.view[end:available]
+            if limit is not None:
+                limit -= 1
+            elif available < len(self.buffer):
+                break
+        return received
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+from array import array
+from palette import brightnessTables, scaleFrame, blendFrame
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class FrameBuffer():
+    """Output frame the layers are composed into, plus a shadow copy of the frame on the strip.
+    Pure Python version, works everywhere."""
+
+    def __init__(self, ledCount):
+        self.ledCount = ledCount
+        self.tables = brightnessTables()
+        self.frame = array('I', [0] * ledCount)
+        self.shown = None
+
+    def clear(self):
+        for i in range(self.ledCount):
+            self.frame[i] = 0
+
+    def draw(self, pixels, brightness):
+        """Replace the output frame with pixels at the given brightness."""
+        scaleFrame(pixels, self.tables[brightness], self.frame)
+
+    def blend(self, pixels, brightness, coverage, litOnly=False):
+        """Draw pixels over the output frame, which keeps 255 - coverage of its brightness."""
+        blendFrame(pixels, self.tables[brightness], self.tables[255 - coverage], self.frame, litOnly)
+
+    def push(self, strip):
+        """Write the output frame to the strip with a single show(). Returns False and does
+        nothing if the strip already shows the same frame."""
+        frame = self.frame
+        if self.shown is None:
+            self.shown = array('I', frame)
+            for i in range(self.ledCount):
+                strip.setPixelColor(i, frame[i])
+        elif frame == self.shown:
+            return False
+        else:
+            shown = self.shown
+            for i in range(self.ledCount):
+                if shown[i] != frame[i]:
+                    shown[i] = frame[i]
+                    strip.setPixelColor(i, frame[i])
+        strip.show()
+        return True
+
+class NumpyFrameBuffer(FrameBuffer):
+    """Same as FrameBuffer but composes whole frames with vectorized lookups."""
+
+    def __init__(self, ledCount):
+        FrameBuffer.__init__(self, ledCount)
+        self.tables = numpy.array([numpy.frombuffer(table, dtype=numpy.uint8) for table in self.tables])
+        self.frame = numpy.zeros(ledCount, dtype=numpy.uint32)
+        # Byte view of the output frame, one row of 4 channels per pixel
+        self.channels = self.frame.view(numpy.uint8).reshape(ledCount, 4)
+        self.blended = numpy.zeros((ledCount, 4), dtype=numpy.uint16)
+
+    def __pixels(self, pixels):
+        # Table frames, compiled animation frames and numpy frames all share the same layout
+        return numpy.frombuffer(pixels, dtype=numpy.uint32)
+
+    def clear(self):
+        self.frame.fill(0)
+
+    def draw(self, pixels, brightness):
+        self.channels[:] = self.tables[brightness][self.__pixels(pixels).view(numpy.uint8).reshape(self.ledCount, 4)]
+
+    def blend(self, pixels, brightness, coverage, litOnly=False):
+        source = self.__pixels(pixels)
+        blended = self.blended
+        numpy.add(self.tables[brightness][source.view(numpy.uint8).reshape(self.ledCount, 4)], self.tables[255 - coverage][self.channels], out=blended, dtype=numpy.uint16)
+        numpy.minimum(blended, 255, out=blended)
+        if litOnly:
+            lit = source != 0
+            self.channels[lit] = blended[lit]
+        else:
+            self.channels[:] = blended
+
+    def push(self, strip):
+        if self.shown is not None and numpy.array_equal(self.frame, self.shown):
+            return False
+        if self.shown is None:
+            changed = range(self.ledCount)
+            self.shown = self.frame.copy()
+        else:
+            changed = numpy.nonzero(self.frame != self.shown)[0].tolist()
+            self.shown[:] = self.frame
+        frame = self.frame
+        for i in changed:
+            strip.setPixelColor(i, int(frame[i]))
+        strip.show()
+        return True
+
+def createFrameBuffer(ledCount, useNumpy=True):
+    """NumPy backed frame buffer if NumPy is installed, the pure Python one otherwise."""
+    if useNumpy and numpy is not None:
+        return NumpyFrameBuffer(ledCount)
+    return FrameBuffer(ledCount)
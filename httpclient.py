@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+import asyncio
+import socket
+
+POOL_SIZE = 2            # Idle connections kept open
+REQUEST_TIMEOUT = 5      # Seconds for connecting plus the whole exchange
+MAX_HEADER_LINES = 100
+
+class HttpError(Exception):
+    pass
+
+class HttpConnectionPool():
+    """Minimal asyncio HTTP/1.1 client for a single local server. Connections are kept
+    alive and reused, so a request does not pay for TCP setup. Must only be used from the
+    event loop it was created in."""
+
+    def __init__(self, host, port, poolSize=POOL_SIZE, timeout=REQUEST_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.poolSize = poolSize
+        self.timeout = timeout
+        self.idle = []
+        self.connects = 0
+
+    async def post(self, path):
+        """Returns the status code and the body. Raises OSError, HttpError or
+        asyncio.TimeoutError if the server can not be reached."""
+        return await asyncio.wait_for(self.__request("POST", path), self.timeout)
+
+    async def __request(self, method, path):
+        while self.idle:
+            connection = self.idle.pop()
+            try:
+                return await self.__exchange(connection, method, path)
+            except (OSError, HttpError, asyncio.IncompleteReadError):
+                # The server closed the idle connection in the meantime
+                self.__close(connection)
+        connection = await asyncio.open_connection(self.host, self.port)
+        # Requests are small and latency matters more than packet count
+        connection[1].get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.connects += 1
+        return await self.__exchange(connection, method, path)
+
+    async def __exchange(self, connection, method, path):
+        reader, writer = connection
+        try:
+            writer.write((method + " " + path + " HTTP/1.1\r\nHost: " + self.host + ":" + str(self.port) + "\r\nContent-Length: 0\r\n\r\n").encode("ascii"))
+            await writer.drain()
+            status, headers = await self.__readHead(reader)
+            body = await self.__readBody(reader, headers)
+        except BaseException:
+            self.__close(connection)
+            raise
+        if headers.get("connection", "").lower() == "close" or len(self.idle) >= self.poolSize:
+            self.__close(connection)
+        else:
+            self.idle.append(connection)
+        return status, body
+
+    async def __readHead(self, reader):
+        statusLine = await reader.readline()
+        if not statusLine:
+            raise HttpError("Connection closed by server")
+        parts = statusLine.decode("latin-1").split(" ", 2)
+        if len(parts) < 2 or not parts[1].isdigit():
+            raise HttpError("Invalid status line: " + statusLine.decode("latin-1").rstrip())
+        headers = {}
+        for i in range(MAX_HEADER_LINES):
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                return int(parts[1]), headers
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        raise HttpError("Too many header lines")
+
+    async def __readBody(self, reader, headers):
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            body = b""
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    # Skip trailers
+                    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                        pass
+                    return body
+                body += (await reader.readexactly(size + 2))[:-2]
+        if "content-length" in headers:
+            return await reader.readexactly(int(headers["content-length"]))
+        # No length given, the body ends with the connection
+        headers["connection"] = "close"
+        return await reader.read()
+
+    def __close(self, connection):
+        connection[1].close()
+
+    def close(self):
+        for connection in self.idle:
+            self.__close(connection)
+        self.idle = []
@@ -4,8 +4,15 @@ import logging
 import time
 import sys
 from meter import Meter
+from animation import AnimationCache, rainbowCycle, theaterChaseRainbow, skip, pulse, flash
+from spectrum import SpectrumMeter
+from palette import METER_STEPS, METER_LEFT_CHANNEL_LEDS, METER_RIGHT_CHANNEL_LEDS, SPECTRUM_BANDS, clampLevel, volumeFrames, meterFrames, meterGradient, meterLevelTable, spectrumColors, gammaTables, fadeLevels
+from scheduler import FrameScheduler, FrameStats
+from framebuffer import createFrameBuffer
 from rpi_ws281x import PixelStrip, Color
-from threading import Thread, Event
+from threading import Thread, Event, Lock
+from queue import Queue, Empty
+from array import array
 
 LED_COUNT = 24        # Number of LED pixels.
 LED_PIN = 12          # GPIO pin connected to the pixels
@@ -14,206 +21,361 @@ LED_DMA = 10          # DMA channel to use for generating signal (try 10)
 LED_BRIGHTNESS = 128   # Set to 0 for darkest and 255 for brightest
 LED_INVERT = False    # True to invert the signal (when using NPN transistor level shift)
 LED_CHANNEL = 0       # set to '1' for GPIOs 13, 19, 41, 45 or 53
+METER_BRIGHTNESS = 25 # Brightness used while the level meter is shown
+FADE_FRAME_RATE = 25  # Frames per second for fades and pulses
+FADE_OUT_DURATION = 5 # In seconds
+PULSE_DURATION = 1    # Seconds for one half (fade in or fade out) of a pulse
+TARGET_FRAME_RATE = 50 # Default maximum frames per second for animations
+ANIMATION_CACHE_DIR = 'animations' # Compiled animations are stored here
+
+REQUEST_ANIMATE = 0          # Replace the animation of one layer
+REQUEST_CANCEL = 1
+REQUEST_CLEAR = 2
+REQUEST_METER = 3
+REQUEST_STOP = 4
+REQUEST_SPECTRUM = 5         # Kind of a meter update, queued as REQUEST_METER
+
+# Layer stack, higher layers are drawn on top of lower ones
+LAYER_METER = 0
+LAYER_OVERLAY = 1             # Transient feedback like volume, skip or the wait animation
+LAYER_PROGRAMMING = 2
+LAYER_LOW_POWER = 3
+
+BLEND_OPAQUE = 0              # Hides everything below
+BLEND_CROSSFADE = 1           # Layers below show through as the layer fades out
+BLEND_MASK = 2                # Only lit pixels cover the layers below
+
+class Layer():
+    """One level of the layer stack. Only used by the render thread."""
+
+    def __init__(self, priority):
+        self.priority = priority
+        self.animation = None
+        self.frame = None
+        self.brightness = LED_BRIGHTNESS
+        self.blend = BLEND_OPAQUE
+        self.alpha = 255
+
+    def covers(self):
+        """True if nothing below this layer can be seen."""
+        return self.frame is not None and self.blend == BLEND_OPAQUE and self.alpha == 255
+
+    def stop(self):
+        if self.animation is not None:
+            self.animation.close()
+        self.animation = None
+        self.frame = None
 
 class Led():
     
-    def __init__(self, withMeter=True):
+    def __init__(self, withMeter=True, withSpectrum=False):
         # LED strip configuration:
         self.programmingMode = False
         self.lowPowerMode = False
         self.lowPowerCancelEvent = Event()
         self.lowPowerSignalThread = None
-        self.strip = PixelStrip(LED_COUNT, LED_PIN, LED_FREQ_HZ, LED_DMA, LED_INVERT, LED_BRIGHTNESS, LED_CHANNEL)
+        # Brightness is applied per pixel by the compositor, so the strip itself always runs at full brightness
+        self.strip = PixelStrip(LED_COUNT, LED_PIN, LED_FREQ_HZ, LED_DMA, LED_INVERT, 255, LED_CHANNEL)
         # Intialize the library (must be called once before other functions).
         self.strip.begin()
-        self.cancel_event = Event()
-        self.currentThread = None
-        if withMeter:
-            self.meter = Meter(self.volumeLevel, smooth=True)
+        self.animations = AnimationCache(ANIMATION_CACHE_DIR)
+        self.__buildTables()
+        # Everything below is owned by the render thread. Other threads only
+        # talk to it through the request queue so they never block on the strip.
+        self.requests = Queue()
+        # Latest meter or spectrum update as (kind, payload). Only one request for it is queued
+        # at a time, so levels can not pile up faster than the render thread draws them.
+        self.meterUpdate = None
+        self.meterUpdateLock = Lock()
+        self.layers = [Layer(priority) for priority in (LAYER_METER, LAYER_OVERLAY, LAYER_PROGRAMMING, LAYER_LOW_POWER)]
+        self.layers[LAYER_METER].brightness = METER_BRIGHTNESS
+        self.frameStats = {}
+        self.frameBuffer = createFrameBuffer(self.strip.numPixels())
+        self.framesPushed = 0
+        self.framesSkipped = 0
+        self.renderThread = Thread(target=self.__render, daemon=True)
+        self.renderThread.start()
+        self.meter = None
+        # With the spectrum meter, showSpectrum() switches between the bands and the stereo levels
+        self.spectrumView = withSpectrum
+        if withSpectrum:
+            # Frequency bands from raw PCM, the stereo levels come from the same samples
+            self.meter = SpectrumMeter(self.spectrumLevels, SPECTRUM_BANDS, levelCallback=self.volumeLevel, idleCallback=self.meterIdle)
+            self.meter.startMeter()
+        elif withMeter:
+            self.meter = Meter(self.volumeLevel, smooth=True, autoGain=True, idleCallback=self.meterIdle)
             self.meter.startMeter()
 
-    def __volume(self, volume, fade_delay_ms=3000):
-        """Draw volume visualization. 70% -> green, 20% -> yellow, 10% -> red"""
-        for i in range(self.strip.numPixels()):
-            percentage = ((self.strip.numPixels() - i) / self.strip.numPixels()) * 100
-            if percentage > volume:
-                self.strip.setPixelColor(i, Color(0,0,0))
-            elif (percentage <= 70):
-                self.strip.setPixelColor(i, Color(round(255*(percentage / 70)),255,0))
-            elif (percentage <= 90):
-                self.strip.setPixelColor(i, Color(255,255-round(255*((percentage-70)/20)),0))
+    def __buildTables(self):
+        """Precompute all colors, frames and brightness curves."""
+        ledCount = self.strip.numPixels()
+        self.gammaTables = gammaTables()
+        # Compiled up front so the boot animation starts right away
+        self.rainbow = self.animations.load(rainbowCycle(ledCount, LED_BRIGHTNESS))
+        # The other effects are compiled in the background, compiling on their first use
+        # would stall the render thread and with it every layer
+        effects = [skip(ledCount, LED_BRIGHTNESS, False), skip(ledCount, LED_BRIGHTNESS, True),
+                   pulse(ledCount, Color(0,255,0), LED_BRIGHTNESS, PULSE_DURATION, FADE_FRAME_RATE),
+                   pulse(ledCount, Color(0,255,0), LED_BRIGHTNESS, 0.1, FADE_FRAME_RATE),
+                   pulse(ledCount, Color(255,0,0), LED_BRIGHTNESS, 0.1, FADE_FRAME_RATE),
+                   pulse(ledCount, Color(255,0,0), LED_BRIGHTNESS, 0.2, FADE_FRAME_RATE)]
+        Thread(target=self.animations.preload, args=(effects,), daemon=True).start()
+        self.volumeFrames = volumeFrames(ledCount)
+        self.meterFrames = meterFrames(ledCount)
+        self.meterLevels = meterLevelTable()
+        self.meterColors = meterGradient()
+        # Meter frame with peak markers drawn into it, reused for every update
+        self.meterPeakFrame = array('I', self.meterFrames[0])
+        self.spectrumColors = spectrumColors()
+        self.spectrumFrame = array('I', [0] * ledCount)
+
+    def __render(self):
+        """Render loop. This is the only thread that touches the strip."""
+        while True:
+            timeout = None
+            deadline = self.__nextDeadline()
+            if deadline is not None:
+                timeout = max(0, deadline - time.monotonic())
+            dirty = False
+            try:
+                request = self.requests.get(timeout=timeout)
+                while True:
+                    if request[0] == REQUEST_STOP:
+                        for layer in self.layers:
+                            layer.stop()
+                        self.frameBuffer.clear()
+                        self.__show()
+                        return
+                    try:
+                        dirty = self.__handleRequest(request) or dirty
+                    except Exception as e:
+                        logging.error("Could not handle LED request " + str(request[0]) + ": " + str(e))
+                    request = self.requests.get_nowait()
+            except Empty:
+                pass
+            now = time.monotonic()
+            for layer in self.layers:
+                if layer.animation is not None and now >= layer.animation.nextDeadline():
+                    try:
+                        self.__advanceAnimation(layer, now)
+                    except Exception as e:
+                        # Only this layer stops, the others keep animating
+                        logging.error("LED animation of layer " + str(layer.priority) + " failed: " + str(e))
+                        layer.stop()
+                    dirty = True
+            if dirty:
+                try:
+                    self.__compose()
+                except Exception as e:
+                    logging.error("Could not draw LED frame: " + str(e))
+
+    def __nextDeadline(self):
+        deadlines = [layer.animation.nextDeadline() for layer in self.layers if layer.animation is not None]
+        return min(deadlines) if deadlines else None
+
+    def __handleRequest(self, request):
+        kind, payload = request
+        if kind == REQUEST_ANIMATE:
+            priority, function, args, blend, alpha, fps = payload
+            layer = self.layers[priority]
+            # Keep the last frame until the new animation draws, a fade out starts from it
+            if layer.animation is not None:
+                layer.animation.close()
+            name = function.__name__.strip('_')
+            if name not in self.frameStats:
+                self.frameStats[name] = FrameStats(name)
+            layer.animation = FrameScheduler(function(layer, *args), fps, self.frameStats[name])
+            layer.blend = blend
+            layer.alpha = alpha
+            return False
+        if kind == REQUEST_CANCEL:
+            for layer in self.layers[LAYER_METER + 1:]:
+                layer.stop()
+        elif kind == REQUEST_CLEAR:
+            for layer in self.layers:
+                layer.stop()
+        elif kind == REQUEST_METER:
+            with self.meterUpdateLock:
+                update = self.meterUpdate
+                self.meterUpdate = None
+            if update is None:
+                return False
+            kind, payload = update
+            meter = self.layers[LAYER_METER]
+            if payload is None:
+                # The meter went idle and stops drawing until the next level
+                meter.frame = None
+            elif kind == REQUEST_METER:
+                meter.frame = self.__meterFrame(*payload)
             else:
-                self.strip.setPixelColor(i, Color(255,0,0))
-        self.strip.show()
-        flag = self.cancel_event.wait(fade_delay_ms / 1000.0)
-        if not flag:
-            self.__fadeOut()
-    
-    def __fadeOut(self, wait_ms=40):
-        while self.strip.getBrightness() > 0:
-            self.strip.setBrightness(self.strip.getBrightness() - 1)
-            self.strip.show()
-            flag = self.cancel_event.wait(wait_ms / 1000.0)
-            if flag:
-                self.strip.setBrightness(LED_BRIGHTNESS)
-                self.clear()
-                return
-        self.clear()
-        self.strip.setBrightness(LED_BRIGHTNESS)
-
-    def __wheel(self, pos):
-        """Generate rainbow colors across 0-255 positions."""
-        if pos < 85:
-            return Color(pos * 3, 255 - pos * 3, 0)
-        elif pos < 170:
-            pos -= 85
-            return Color(255 - pos * 3, 0, pos * 3)
+                meter.frame = self.__spectrumFrame(payload)
+            # No need to draw if the meter is hidden anyway
+            return not any(layer.covers() for layer in self.layers[LAYER_METER + 1:])
+        return True
+
+    def __advanceAnimation(self, layer, now):
+        if layer.animation.advance(now):
+            layer.frame, layer.brightness, delay = layer.animation.current
+        else:
+            layer.animation = None
+            layer.frame = None
+
+    def __compose(self):
+        """Blend all layers into one output frame, starting at the topmost layer that hides
+        everything below it."""
+        bottom = 0
+        for layer in self.layers:
+            if layer.covers():
+                bottom = layer.priority
+        empty = True
+        for layer in self.layers[bottom:]:
+            if layer.frame is None:
+                continue
+            brightness = layer.brightness * layer.alpha // 255
+            if empty:
+                self.frameBuffer.draw(layer.frame, brightness)
+                empty = False
+                continue
+            coverage = layer.alpha
+            if layer.blend == BLEND_CROSSFADE:
+                coverage = min(255, layer.alpha * layer.brightness // LED_BRIGHTNESS)
+            self.frameBuffer.blend(layer.frame, brightness, coverage, layer.blend == BLEND_MASK)
+        if empty:
+            self.frameBuffer.clear()
+        self.__show()
+
+    def __show(self):
+        """Push the composed frame unless it equals the one already on the strip."""
+        if self.frameBuffer.push(self.strip):
+            self.framesPushed += 1
         else:
-            pos -= 170
-            return Color(0, pos * 3, 255 - pos * 3)
+            self.framesSkipped += 1
+
+    def getFrameCounters(self):
+        """Number of frames pushed to the strip and skipped because nothing changed."""
+        return self.framesPushed, self.framesSkipped
+
+    def getFrameStats(self):
+        """Missed deadlines, dropped frames and frame time percentiles per animation."""
+        return {name: stats.summary() for name, stats in list(self.frameStats.items())}
+
+    def __request(self, kind, payload=None):
+        self.requests.put((kind, payload))
+
+    def __requestMeter(self, kind, payload):
+        """Replace the pending meter update, queue a request only if none is pending."""
+        with self.meterUpdateLock:
+            pending = self.meterUpdate is not None
+            self.meterUpdate = (kind, payload)
+        if not pending:
+            self.__request(REQUEST_METER)
+
+    def __animate(self, layer, function, *args, blend=BLEND_OPAQUE, alpha=255, fps=TARGET_FRAME_RATE):
+        """Run function(layer, *args) as the animation of a layer."""
+        self.__request(REQUEST_ANIMATE, (layer, function, args, blend, alpha, fps))
+
+    def __fade(self, pixels, fromBrightness, toBrightness, duration):
+        """Fade a frame between two brightness levels using a bounded number of frames."""
+        steps = max(1, round(duration * FADE_FRAME_RATE))
+        for brightness in fadeLevels(fromBrightness, toBrightness, steps, self.gammaTables):
+            yield pixels, brightness, 1.0 / FADE_FRAME_RATE
+
+    def __play(self, animation, iterations=1):
+        """Stream a compiled animation. iterations == 0 means infinite"""
+        if iterations == 0:
+            iterations = sys.maxsize
+        period = 1.0 / animation.fps
+        frames = animation.frames
+        levels = animation.levels
+        holds = animation.holds
+        for iteration in range(iterations):
+            for i in range(animation.frameCount):
+                yield frames[i], levels[i], holds[i] * period
+
+    def __volume(self, layer, volume, fade_delay_ms=3000):
+        """Draw volume visualization. 70% -> green, 20% -> yellow, 10% -> red"""
+        pixels = self.volumeFrames[clampLevel(volume)]
+        yield pixels, LED_BRIGHTNESS, fade_delay_ms / 1000.0
+        yield from self.__fade(pixels, LED_BRIGHTNESS, 0, FADE_OUT_DURATION)
+    
+    def __fadeOut(self, layer, duration=FADE_OUT_DURATION):
+        """Fade out whatever the layer currently shows."""
+        if layer.frame is not None:
+            yield from self.__fade(layer.frame, layer.brightness, 0, duration)
 
-    def __skip(self, invert, trail=6, wait_ms=50):
+    def __skip(self, layer, invert, trail=6, wait_ms=50):
         """Left to right or right to left swipe."""
-        lightsArray = [[19], [18, 20], [17, 21], [16, 22], [15, 23], [14, 24], [13, 1], [12, 2], [11, 3], [10, 4], [9, 5], [8, 6], [7]]
-        if invert:
-            lightsArray = lightsArray[::-1]
-        for lights in range(12 + trail):
-            if lights <= 12:
-                for light in lightsArray[lights]:
-                    self.strip.setPixelColor(light, Color(0,255,0))
-            if lights - (trail - 1) >= 0:
-                for light in lightsArray[lights - (trail - 1)]:
-                    self.strip.setPixelColor(light, Color(0,0,0))
-            self.strip.show()
-            sleep_multi = abs(lights - 7) / 7
-            flag = self.cancel_event.wait((wait_ms * sleep_multi) / 1000.0)
-            if flag:
-                self.clear()
-                return
+        yield from self.__play(self.animations.load(skip(self.strip.numPixels(), LED_BRIGHTNESS, invert, trail, wait_ms)))
+
+    def __meterFrame(self, leftChannel, rightChannel, leftPeak=None, rightPeak=None):
+        left = self.meterLevels[clampLevel(leftChannel)]
+        right = self.meterLevels[clampLevel(rightChannel)]
+        frame = self.meterFrames[left * METER_STEPS + right]
+        if leftPeak is None and rightPeak is None:
+            return frame
+        peakFrame = self.meterPeakFrame
+        peakFrame[:] = frame
+        self.__drawPeak(peakFrame, METER_LEFT_CHANNEL_LEDS, leftPeak, left)
+        self.__drawPeak(peakFrame, METER_RIGHT_CHANNEL_LEDS, rightPeak, right)
+        return peakFrame
+
+    def __drawPeak(self, frame, leds, peak, lit):
+        """Light the single step of a channel that marks its peak level."""
+        if peak is None:
+            return
+        step = self.meterLevels[clampLevel(peak)] - 1
+        if step >= lit and leds[step] < len(frame):
+            frame[leds[step]] = self.meterColors[step]
 
-    def volumeLevel(self, leftChannel, rightChannel):
-        if self.currentThread is not None and self.currentThread.is_alive():
+    def volumeLevel(self, leftChannel, rightChannel, leftPeak=None, rightPeak=None):
+        if self.spectrumView:
             return
+        self.__requestMeter(REQUEST_METER, (leftChannel, rightChannel, leftPeak, rightPeak))
+
+    def __spectrumFrame(self, bands):
+        """Mirror the bands on both halves of the ring, the lowest one at the bottom."""
+        frame = self.spectrumFrame
+        ledCount = len(frame)
+        for i in range(min(len(bands), SPECTRUM_BANDS)):
+            color = self.spectrumColors[i][clampLevel(bands[i])]
+            if METER_LEFT_CHANNEL_LEDS[i] < ledCount:
+                frame[METER_LEFT_CHANNEL_LEDS[i]] = color
+            if METER_RIGHT_CHANNEL_LEDS[i] < ledCount:
+                frame[METER_RIGHT_CHANNEL_LEDS[i]] = color
+        return frame
+
+    def spectrumLevels(self, bands):
+        """One level 0-100 per frequency band."""
+        if not self.spectrumView:
+            return
+        self.__requestMeter(REQUEST_SPECTRUM, list(bands))
 
-        greenPercentage = 40
-        yellowPercentage = 60
-        redPercentage = 75
-        rightChannelLeds = [12, 13, 14, 15, 16, 17, 18, 19, 20, 21, 22, 23, 0]
-        leftChannelLeds = [12, 11, 10, 9, 8, 7, 6, 5, 4, 3, 2, 1, 0]
-        
-        steps = 100 / (len(leftChannelLeds) + 1)
+    def showSpectrum(self, enabled):
+        """Show the frequency bands or the stereo levels of a spectrum meter."""
+        if isinstance(self.meter, SpectrumMeter):
+            self.spectrumView = enabled
 
-        for i in range(len(leftChannelLeds)):
+    def meterIdle(self):
+        """Nothing is playing. The meter layer is hidden until the next volumeLevel()."""
+        self.__requestMeter(REQUEST_METER, None)
 
-            red = round(255 * min(1, (max(0, (i * steps - greenPercentage)) / (yellowPercentage - greenPercentage))))
-            green = round(255 - (255 * min(1, max(0, (i * steps - yellowPercentage)) / (redPercentage - yellowPercentage))))
-            blue = 0
-            
-            color = Color(red, green, blue)
-            leftLed = leftChannelLeds[i]
-            rightLed = rightChannelLeds[i]
-            if leftLed == rightLed:
-                if i * steps < max(leftChannel, rightChannel):
-                    self.strip.setPixelColor(leftLed, color)
-                else:
-                    self.strip.setPixelColor(leftLed, Color(0,0,0))
-            else:
-                if i * steps < leftChannel:
-                    self.strip.setPixelColor(leftLed, color)
-                else:
-                    self.strip.setPixelColor(leftLed, Color(0,0,0))
-                if i * steps < rightChannel:
-                    self.strip.setPixelColor(rightLed, color)
-                else:
-                    self.strip.setPixelColor(rightLed, Color(0,0,0))
-                    
-        self.strip.setBrightness(25)
-        self.strip.show()
-        self.strip.setBrightness(LED_BRIGHTNESS)
-
-    def __theaterChaseRainbow(self, wait_ms=50):
+    def __theaterChaseRainbow(self, layer, wait_ms=50):
         """Rainbow movie theater light style chaser animation."""
-        for j in range(256):
-            for q in range(3):
-                for i in range(0, self.strip.numPixels(), 3):
-                    self.strip.setPixelColor(i + q, self.__wheel((i + j) % 255))
-                self.strip.show()
-                flag = self.cancel_event.wait(wait_ms / 1000.0)
-                if flag:
-                    return
-                for i in range(0, self.strip.numPixels(), 3):
-                    self.strip.setPixelColor(i + q, 0)
-
-    def __rainbowCycle(self, wait_ms=10, iterations=10000):
+        yield from self.__play(self.animations.load(theaterChaseRainbow(self.strip.numPixels(), LED_BRIGHTNESS, wait_ms)))
+
+    def __rainbowCycle(self, layer, iterations=10000):
         """Draw rainbow that uniformly distributes itself across all pixels."""
-        for j in range(256 * iterations):
-            for i in range(self.strip.numPixels()):
-                self.strip.setPixelColor(i, self.__wheel(
-                    (int(i * 256 / self.strip.numPixels()) + j) & 255))
-            self.strip.show()
-            flag = self.cancel_event.wait(wait_ms / 1000.0)
-            if flag:
-                return
+        yield from self.__play(self.rainbow, iterations)
     
     # iterations == 0 means infinite
-    def __pulse(self, color, iterations=0, wait_ms=15):
-        for i in range(self.strip.numPixels()):
-            self.strip.setPixelColor(i, color)
-        self.strip.setBrightness(0)
-        self.strip.show()
-        if iterations == 0:
-            remainingIterations = sys.maxsize
-        else:
-            remainingIterations = iterations
-        while self.strip.getBrightness() < LED_BRIGHTNESS:
-            self.strip.setBrightness(self.strip.getBrightness() + 1)
-            self.strip.show()
-            sleep_multi = self.strip.getBrightness() / LED_BRIGHTNESS
-            flag = self.cancel_event.wait(sleep_multi* (wait_ms / 1000.0))
-            if flag:
-                return
-            if self.strip.getBrightness() == LED_BRIGHTNESS:
-                remainingIterations = remainingIterations - 1
-                while self.strip.getBrightness() > 0:
-                    self.strip.setBrightness(self.strip.getBrightness() - 1)
-                    self.strip.show()
-                    sleep_multi = self.strip.getBrightness() / LED_BRIGHTNESS
-                    flag = self.cancel_event.wait(sleep_multi* (wait_ms / 1000.0))
-                    if flag:
-                        return
-                    if self.strip.getBrightness() == 0 and remainingIterations == 0:
-                        self.clear()
-                        self.strip.setBrightness(LED_BRIGHTNESS)
-                        return
+    def __pulse(self, layer, color, iterations=0, duration=PULSE_DURATION):
+        yield from self.__play(self.animations.load(pulse(self.strip.numPixels(), color, LED_BRIGHTNESS, duration, FADE_FRAME_RATE)), iterations)
 
-    def __flash(self, color, wait_ms=0.1):
-        for i in range(self.strip.numPixels()):
-            self.strip.setPixelColor(i, color)
-        self.strip.setBrightness(0)
-        self.strip.show()
-        while self.strip.getBrightness() < LED_BRIGHTNESS:
-            sleep_multi = self.strip.getBrightness() / LED_BRIGHTNESS
-            flag = self.cancel_event.wait(wait_ms / 1000.0)
-            if flag:
-                self.strip.setBrightness(LED_BRIGHTNESS)
-                return
-            self.strip.setBrightness(self.strip.getBrightness() + 1)
-            self.strip.show()
-        while self.strip.getBrightness() > 0:
-            sleep_multi = self.strip.getBrightness() / LED_BRIGHTNESS
-            flag = self.cancel_event.wait(wait_ms / 1000.0)
-            if flag:
-                self.strip.setBrightness(LED_BRIGHTNESS)
-                return
-            self.strip.setBrightness(self.strip.getBrightness() - 1)
-            self.strip.show()
-        self.strip.setBrightness(LED_BRIGHTNESS)
-        self.clear()
+    def __flash(self, layer, color, duration=0.05):
+        yield from self.__play(self.animations.load(flash(self.strip.numPixels(), color, LED_BRIGHTNESS, duration, FADE_FRAME_RATE)))
 
     def clear(self):
-        for i in range(self.strip.numPixels()):
-            self.strip.setPixelColor(i, Color(0,0,0))
-            self.strip.show()
+        self.__request(REQUEST_CLEAR)
     
     def engageLowPowerMode(self, powerIsLow):
         if powerIsLow and not self.lowPowerMode:
@@ -238,63 +400,58 @@ class Led():
             if flag:
                 return
 
-            # Skip signaling when something else is currently going on
-            if self.currentThread is None or not self.currentThread.is_alive():
-                self.currentThread = Thread(target=self.__pulse, args=([Color(255,0,0), 3, 3]))
-                self.currentThread.start()
+            # Pulses on top of everything else, which shows through as it fades
+            self.__animate(LAYER_LOW_POWER, self.__pulse, Color(255,0,0), 3, 0.2, blend=BLEND_CROSSFADE)
             
     
     def engageProgrammingMode(self):
         logging.info("Entering programming mode")
         self.programmingMode = True
-        self.cancel()
-        self.currentThread = Thread(target=self.__pulse, args=([Color(0,255,0)]))
-        self.currentThread.start()
+        self.__animate(LAYER_PROGRAMMING, self.__pulse, Color(0,255,0))
 
     def programmingSucessful(self):
         logging.info("Programming was successful. Stopping animation...")
-        # Assume that the current animation is the "programming pulse"
-        self.cancel()
-        self.currentThread = Thread(target=self.__pulse, args=([Color(0,255,0), 3, 1]))
-        self.currentThread.start()
+        # Replaces the "programming pulse"
+        self.__animate(LAYER_PROGRAMMING, self.__pulse, Color(0,255,0), 3, 0.1)
         self.programmingMode = False
 
     def programmingFailed(self):
         logging.info("Programming was not successful. Stopping animation...")
-        # Assume that the current animation is the "programming pulse"
-        self.cancel()
-        self.currentThread = Thread(target=self.__pulse, args=([Color(255,0,0), 3, 1]))
-        self.currentThread.start()
+        # Replaces the "programming pulse"
+        self.__animate(LAYER_PROGRAMMING, self.__pulse, Color(255,0,0), 3, 0.1)
         self.programmingMode = False
 
     def signalVolumeChange(self, newVolume):
+        if self.meter is not None:
+            self.meter.setVolume(newVolume)
+        if not self.programmingMode:
+            self.__animate(LAYER_OVERLAY, self.__volume, newVolume, blend=BLEND_CROSSFADE)
+
+    def signalSkip(self, backwards):
+        """Swipe over the meter, which stays visible around the lit pixels."""
         if not self.programmingMode:
-            self.cancel()
-            self.currentThread = Thread(target=self.__volume, args=([newVolume]))
-            self.currentThread.start()
+            self.__animate(LAYER_OVERLAY, self.__skip, backwards, blend=BLEND_MASK)
     
     def startWaitAninmation(self):
-        self.cancel()
-        self.currentThread = Thread(target=self.__rainbowCycle)
-        self.currentThread.start()
+        self.__animate(LAYER_OVERLAY, self.__rainbowCycle)
 
     def stopWaitAninmation(self):
-        self.cancel()
-        self.currentThread = Thread(target=self.__fadeOut)
-        self.currentThread.start()
+        self.__animate(LAYER_OVERLAY, self.__fadeOut, blend=BLEND_CROSSFADE)
 
     def cancel(self):
-        if self.currentThread is not None and self.currentThread.is_alive():
-            self.cancel_event.set()
-            self.currentThread.join()
-            self.currentThread = None
-        self.cancel_event.clear()
+        self.__request(REQUEST_CANCEL)
     
     def cleanup(self):
         self.lowPowerCancelEvent.set()
-        self.meter.stopMeter()
-        self.cancel()
-        self.clear()
+        if self.meter is not None:
+            self.meter.stopMeter()
+        # Blanks the strip before the render thread exits
+        self.__request(REQUEST_STOP)
+        self.renderThread.join()
+        pushed, skipped = self.getFrameCounters()
+        logging.debug("LED frames pushed: " + str(pushed) + ", skipped: " + str(skipped))
+        for name, stats in self.getFrameStats().items():
+            logging.debug("Animation " + name + ": " + str(stats))
 
 # Used for testing
 if __name__ == "__main__":
@@ -3,7 +3,6 @@
 from button import *
 import signal
 import RPi.GPIO as GPIO
-import json
 import sys
 import logging
 import traceback
@@ -59,17 +58,19 @@ class Box():
             logging.info("Engaging programming mode")
             self.startProgrammingMode(uid)
 
-    def encoderChanged(self, value, direction):
+    def encoderChanged(self, value, direction, steps):
         logging.info("Detected volume change event. Current value: " + str(value) + " and direction: " + direction)
         if direction == "R":
-            self.player.increaseVolume()
+            self.player.changeVolume(steps)
         if direction == "L":
-            self.player.decreaseVolume()
+            self.player.changeVolume(-steps)
 
     def prevButtonPressed(self):
+        self.led.signalSkip(True)
         self.player.prev()
 
     def nextButtonPressed(self):
+        self.led.signalSkip(False)
         self.player.next()
 
     def runningOnBackup(self, backup):
@@ -119,7 +120,9 @@ class Box():
 
     def __setupPlayer(self):
         logging.info("Trying to connect to librespot-java...")
-        self.player = Player(self.playerMessageReceived, self.playerConnected)
+        self.player = Player(self.playerConnected)
+        self.player.on("volumeChanged", self.playerVolumeChanged)
+        self.player.on("contextChanged", self.playerContextChanged)
     
     def __setupDatabase(self):
         logging.info("Loading playlist database")
@@ -132,7 +135,7 @@ class Box():
 
     def __setupVolumeControl(self):
         logging.info("Setting up volume control")
-        self.encoder = Encoder(13, 16, self.encoderChanged)
+        self.encoder = Encoder(13, 16, self.encoderChanged, acceleration=True)
     
     def __setupButtons(self):
         self.buttonManager = ButtonManager(self)
@@ -175,36 +178,34 @@ class Box():
         else:
             self.led.startWaitAninmation()
 
-    def playerMessageReceived(self, message):
-        messageDict = json.loads(message)
-        eventType = messageDict["event"]
-        if eventType == "volumeChanged":
-            self.led.signalVolumeChange(round(messageDict["value"] * 100))
-        if eventType == "contextChanged":
-            if self.programmingMode:
-                if self.programmingModeThread is not None and self.programmingModeThread.is_alive():
-                    self.programmingModeCancelEvent.set()
-                    self.programmingModeThread.join()
-                    self.programmingModeCancelEvent.clear()
-                try:
-                    self.database.setPlaylist(self.programmingUid, messageDict["uri"])
-                    self.stopProgrammingMode()
-                except Exception as e:
-                    logging.warning(e)
-                    self.stopProgrammingMode(False)
-        logging.info(message)
+    def playerVolumeChanged(self, event):
+        self.led.signalVolumeChange(round(event.value * 100))
+
+    def playerContextChanged(self, event):
+        logging.info("Player context changed to " + str(event.uri))
+        if self.programmingMode:
+            if self.programmingModeThread is not None and self.programmingModeThread.is_alive():
+                self.programmingModeCancelEvent.set()
+                self.programmingModeThread.join()
+                self.programmingModeCancelEvent.clear()
+            try:
+                self.database.setPlaylist(self.programmingUid, event.uri)
+                self.stopProgrammingMode()
+            except Exception as e:
+                logging.warning(e)
+                self.stopProgrammingMode(False)
 
     def shutdown(self):
         logging.info("Shutdown sequence started...")
         self.programmingModeCancelEvent.set()
         self.connectionManager.cleanup()
         self.buttonManager.cleanup()
-        self.led.cancel()
-        self.led.clear()
+        self.led.cleanup()
         self.shutdownManager.cleanup()
         self.power.cleanup()
         self.player.cleanup()
         self.reader.cleanup()
+        self.database.cleanup()
 
 def shutdown(signum, frame):
     logging.debug("Received signal " + str(signum))
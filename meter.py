@@ -1,67 +1,158 @@
 #!/usr/bin/env python
 
-import os
 import time
-import errno
 import logging
+from dsp import FRAME, FULL_SCALE_LEVEL, AutoGain, LevelProcessor
+from fifo import FifoReader
+from scheduler import Deadline
 from threading import RLock, Event, Thread
 
 PIPE = '/home/comitup/meter'
-POLLING_INTERVAL = 0.033
+POLLING_INTERVAL = 0.033 # Minimum time between two callbacks
+SMOOTH_INTERVAL = 0.05 # Time between two callbacks in smooth mode, the envelopes keep it fluid
+STALE_TIME = 0.2 # Levels fall to zero if no new frames arrived for this long
+READ_BUFFER_SIZE = 4096 # Must be a multiple of the frame size
+IDLE_TIME = 3.0 # Seconds of silence before the meter goes idle
+IDLE_POLL_INTERVAL = 0.25 # Time between two reads while idle, in case silence keeps coming in
 
 class Meter():
 
-    def __init__(self, callback, smooth=False):
-        self.pipe = os.open(PIPE, os.O_RDONLY | os.O_NONBLOCK)
+    def __init__(self, callback, smooth=False, autoGain=False, idleCallback=None):
+        self.fifo = FifoReader(PIPE, READ_BUFFER_SIZE, FRAME.size)
         self.lock = RLock()
         self.callback = callback
         self.cancel_event = Event()
+        # In smooth mode the levels go through the DSP stage and peaks are reported as well
         self.smooth = smooth
-        self.latest_data = [0, 0, 0, 0]
+        self.processor = LevelProcessor() if smooth else None
+        # Without auto gain, FULL_SCALE_LEVEL is shown as 100%
+        self.gain = AutoGain() if autoGain else None
+        self.left = 0
+        self.right = 0
+        # After IDLE_TIME of silence idleCallback is called once and callback is not called
+        # again until there is a non-zero level
+        self.idleCallback = idleCallback
+        self.idle = False
+        self.silentSince = None
 
-    def __flush_pipe(self):
-        try:
-            os.read(self.pipe, 1048576)
-        except Exception as e:
-            logging.warning(e)
+    def __get_pipe_value(self, history=None):
+        """ Read everything available from the named pipe. Keeps the most recent complete
+        frame in self.left and self.right and, if history is given, calls history(block)
+        with every block of complete frames in arrival order. Returns False if no complete
+        frame was read. """
+        def consume(block):
+            if history is not None:
+                history(block)
+            self.left, self.right = FRAME.unpack_from(block, len(block) - FRAME.size)
+        return bool(self.fifo.read(consume))
 
-    def __get_pipe_value(self):
-        """ Read from the named pipe until it's empty """
-        data = None
-        while True:
-            try:
-                data = os.read(self.pipe, 4)
-                if len(data) != 0:
-                    self.latest_data = [data[0], data[1], data[2], data[3]]
-            except:
-                break
-    
     def startMeter(self):
         self.meterThread = Thread(target=self.__run, daemon = True)
         self.meterThread.start()
         return self.meterThread
-    
+
     def stopMeter(self):
         self.cancel_event.set()
+        self.fifo.wake()
+
+    def setVolume(self, volume):
+        """ Player volume in percent, seeds the auto gain. """
+        if self.gain is not None:
+            with self.lock:
+                self.gain.setVolume(volume)
+
+    def __addBlock(self, block):
+        if self.processor is not None:
+            self.processor.add(block)
+        if self.gain is not None:
+            self.gain.add(block)
+
+    def __scale(self, elapsed):
+        """ Factor from raw levels to percent. Call with the lock held. """
+        if self.gain is None:
+            return 100 / FULL_SCALE_LEVEL
+        return self.gain.update(elapsed)
+
+    def __checkIdle(self, now, active):
+        """ Track silence. Returns True if the callback should be skipped. """
+        if active:
+            if self.idle:
+                logging.debug("Meter active again")
+            self.idle = False
+            self.silentSince = None
+            return False
+        if self.idle:
+            return True
+        if self.silentSince is None:
+            self.silentSince = now
+        elif now - self.silentSince >= IDLE_TIME:
+            logging.debug("Meter idle after " + str(IDLE_TIME) + "s of silence")
+            self.idle = True
+            if self.idleCallback is not None:
+                self.idleCallback()
+            return True
+        return False
 
     def __run(self):
         with self.lock:
-            self.__flush_pipe()
+            self.fifo.flush()
+        if self.smooth:
+            self.__runSmooth()
+            return
+        lastUpdate = time.monotonic()
         while True:
-            previous_data = self.latest_data[:]
+            ready = self.fifo.wait(None if self.idle else IDLE_TIME)
+            if ready is False:
+                break
+            now = time.monotonic()
+            if ready is None:
+                # Nothing came in for a while, the audio pipeline is probably stopped
+                self.__checkIdle(now, False)
+                continue
             with self.lock:
-                self.__get_pipe_value()
+                if not self.__get_pipe_value(self.gain.add if self.gain is not None else None):
+                    continue
+                scale = self.__scale(min(now - lastUpdate, STALE_TIME))
+                lastUpdate = now
 
-            # The 45 in the end should actually be set to the alsa master level to scale the volume level to 100% when the master max volume is reached
-            length = 4
-            if self.smooth:
-                left = int(100 * ((((previous_data[length - 4] + (previous_data[length - 3] << 8)) + (self.latest_data[length - 4] + (self.latest_data[length - 3] << 8))) / 2) / 45))
-                right = int(100 * ((((previous_data[length - 2] + (previous_data[length - 1] << 8)) + (self.latest_data[length - 2] + (self.latest_data[length - 1] << 8))) / 2) / 45))
-            else:
-                left = int(100 * ((self.latest_data[length - 4] + (self.latest_data[length - 3] << 8)) / 45))
-                right = int(100 * ((self.latest_data[length - 2] + (self.latest_data[length - 1] << 8)) / 45))
+            left = int(self.left * scale)
+            right = int(self.right * scale)
 
+            if self.__checkIdle(now, left or right):
+                # Only silence is coming in, no need to look at every frame of it
+                if self.cancel_event.wait(IDLE_POLL_INTERVAL):
+                    break
+                continue
+
+            self.callback(left, right)
+
+            # Data that arrives in the meantime is picked up in one go afterwards
             if self.cancel_event.wait(POLLING_INTERVAL):
                 break
 
-            self.callback(left, right)
+    def __runSmooth(self):
+        """ Calls back at a steady rate while levels are moving. Once the envelopes have
+        fallen to zero the thread sleeps until new data arrives or the meter goes idle. """
+        lastData = time.monotonic()
+        deadline = None
+        while True:
+            if self.processor.isSilent():
+                if self.fifo.wait(None if self.idle else IDLE_TIME) is False:
+                    break
+                deadline = Deadline()
+            with self.lock:
+                if self.__get_pipe_value(self.__addBlock):
+                    lastData = time.monotonic()
+                scale = self.__scale(SMOOTH_INTERVAL)
+
+            now = time.monotonic()
+            left, right, leftPeak, rightPeak = self.processor.process(SMOOTH_INTERVAL, scale, now - lastData > STALE_TIME)
+            if self.__checkIdle(now, not self.processor.isSilent()):
+                # Only silence is coming in, no need to look at every frame of it
+                if self.cancel_event.wait(IDLE_POLL_INTERVAL):
+                    break
+                continue
+            self.callback(int(left), int(right), int(leftPeak), int(rightPeak))
+
+            if deadline.wait(self.cancel_event, SMOOTH_INTERVAL):
+                break
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Meter gradient: green below, yellow between and red above these percentages
+METER_GREEN_PERCENTAGE = 40
+METER_YELLOW_PERCENTAGE = 60
+METER_RED_PERCENTAGE = 75
+# Both channels start at the bottom LED (12) and meet at the top LED (0)
+METER_LEFT_CHANNEL_LEDS = [12, 11, 10, 9, 8, 7, 6, 5, 4, 3, 2, 1, 0]
+METER_RIGHT_CHANNEL_LEDS = [12, 13, 14, 15, 16, 17, 18, 19, 20, 21, 22, 23, 0]
+METER_STEPS = len(METER_LEFT_CHANNEL_LEDS) + 1
+SPECTRUM_BANDS = len(METER_LEFT_CHANNEL_LEDS) # Lowest band at the bottom, mirrored on both halves
+MAX_LEVEL = 100
+GAMMA = 2.2 # Perceived brightness curve used to space fade steps
+
+def packColor(red, green, blue, white=0):
+    """Same packing as rpi_ws281x.Color so tables can be built without the hardware library."""
+    return (white << 24) | (red << 16) | (green << 8) | blue
+
+def wheel(pos):
+    """Generate rainbow colors across 0-255 positions."""
+    if pos < 85:
+        return packColor(pos * 3, 255 - pos * 3, 0)
+    elif pos < 170:
+        pos -= 85
+        return packColor(255 - pos * 3, 0, pos * 3)
+    else:
+        pos -= 170
+        return packColor(0, pos * 3, 255 - pos * 3)
+
+def wheelTable():
+    return array('I', [wheel(pos) for pos in range(256)])
+
+def rainbowFrames(ledCount):
+    """All 256 frames of the rainbow cycle."""
+    colors = wheelTable()
+    if numpy is not None:
+        offsets = numpy.arange(ledCount) * 256 // ledCount
+        frames = numpy.frombuffer(colors, dtype=numpy.uint32)[(offsets + numpy.arange(256)[:, None]) & 255]
+        return [array('I', frame.tobytes()) for frame in frames]
+    offsets = [int(i * 256 / ledCount) for i in range(ledCount)]
+    return [array('I', [colors[(offset + j) & 255] for offset in offsets]) for j in range(256)]
+
+def volumeColor(percentage):
+    """70% -> green, 20% -> yellow, 10% -> red"""
+    if percentage <= 70:
+        return packColor(round(255 * (percentage / 70)), 255, 0)
+    elif percentage <= 90:
+        return packColor(255, 255 - round(255 * ((percentage - 70) / 20)), 0)
+    return packColor(255, 0, 0)
+
+def volumeFrames(ledCount):
+    """One frame per volume level 0-100."""
+    percentages = [((ledCount - i) / ledCount) * 100 for i in range(ledCount)]
+    colors = [volumeColor(percentage) for percentage in percentages]
+    if numpy is not None:
+        volumes = numpy.arange(MAX_LEVEL + 1)[:, None]
+        frames = numpy.where(numpy.array(percentages) > volumes, 0, numpy.array(colors, dtype=numpy.uint32)).astype(numpy.uint32)
+        return [array('I', frame.tobytes()) for frame in frames]
+    frames = []
+    for volume in range(MAX_LEVEL + 1):
+        frames.append(array('I', [0 if percentages[i] > volume else colors[i] for i in range(ledCount)]))
+    return frames
+
+def meterGradient():
+    steps = 100 / METER_STEPS
+    colors = array('I')
+    for i in range(len(METER_LEFT_CHANNEL_LEDS)):
+        red = round(255 * min(1, (max(0, (i * steps - METER_GREEN_PERCENTAGE)) / (METER_YELLOW_PERCENTAGE - METER_GREEN_PERCENTAGE))))
+        green = round(255 - (255 * min(1, max(0, (i * steps - METER_YELLOW_PERCENTAGE)) / (METER_RED_PERCENTAGE - METER_YELLOW_PERCENTAGE))))
+        colors.append(packColor(red, green, 0))
+    return colors
+
+def meterLevelTable():
+    """Maps a channel level 0-100 to the number of lit meter steps."""
+    steps = 100 / METER_STEPS
+    return array('B', [sum(1 for i in range(len(METER_LEFT_CHANNEL_LEDS)) if i * steps < level) for level in range(MAX_LEVEL + 1)])
+
+def meterFrames(ledCount):
+    """One frame per combination of lit steps, indexed by left * METER_STEPS + right."""
+    colors = meterGradient()
+    frames = []
+    for left in range(METER_STEPS):
+        for right in range(METER_STEPS):
+            frame = array('I', [0] * ledCount)
+            for i in range(len(METER_LEFT_CHANNEL_LEDS)):
+                leftLed = METER_LEFT_CHANNEL_LEDS[i]
+                rightLed = METER_RIGHT_CHANNEL_LEDS[i]
+                if leftLed == rightLed:
+                    if i < max(left, right) and leftLed < ledCount:
+                        frame[leftLed] = colors[i]
+                else:
+                    if i < left and leftLed < ledCount:
+                        frame[leftLed] = colors[i]
+                    if i < right and rightLed < ledCount:
+                        frame[rightLed] = colors[i]
+            frames.append(frame)
+    return frames
+
+def spectrumColors():
+    """colors[band][level] for levels 0-100. Bands go from red to blue and get brighter with their level."""
+    colors = []
+    for band in range(SPECTRUM_BANDS):
+        color = wheel(band * 170 // SPECTRUM_BANDS)
+        red, green, blue = (color >> 16) & 255, (color >> 8) & 255, color & 255
+        colors.append(array('I', [packColor(red * level // MAX_LEVEL, green * level // MAX_LEVEL, blue * level // MAX_LEVEL) for level in range(MAX_LEVEL + 1)]))
+    return colors
+
+def clampLevel(level):
+    return MAX_LEVEL if level > MAX_LEVEL else (0 if level < 0 else int(level))
+
+def brightnessTables():
+    """tables[level][value] scales a channel value like the ws281x driver does for strip brightness."""
+    return [bytes((value * (level + 1)) >> 8 for value in range(256)) for level in range(256)]
+
+def gammaTables(gamma=GAMMA):
+    """Lookup tables from perceived to physical brightness and back."""
+    toPhysical = bytes(round(255 * (i / 255) ** gamma) for i in range(256))
+    toPerceived = bytes(round(255 * (i / 255) ** (1 / gamma)) for i in range(256))
+    return toPhysical, toPerceived
+
+def fadeLevels(fromLevel, toLevel, steps, gammaTables):
+    """Brightness levels for a fade that looks linear to the eye. The last level is always toLevel."""
+    toPhysical, toPerceived = gammaTables
+    start = toPerceived[fromLevel]
+    end = toPerceived[toLevel]
+    levels = [toPhysical[round(start + (end - start) * step / steps)] for step in range(1, steps)]
+    levels.append(toLevel)
+    return levels
+
+def scaleFrame(frame, table, out):
+    """Write frame scaled by a brightness table into out."""
+    for i in range(len(frame)):
+        color = frame[i]
+        if color == 0:
+            out[i] = 0
+        else:
+            out[i] = (table[color >> 24] << 24) | (table[(color >> 16) & 255] << 16) | (table[(color >> 8) & 255] << 8) | table[color & 255]
+
+def blendFrame(frame, table, belowTable, out, litOnly=False):
+    """Draw frame scaled by table over out, whose pixels are scaled by belowTable first.
+    With litOnly, black pixels of frame leave out untouched. Every channel saturates."""
+    for i in range(len(frame)):
+        color = frame[i]
+        if color == 0 and litOnly:
+            continue
+        below = out[i]
+        white = min(255, table[color >> 24] + belowTable[below >> 24])
+        red = min(255, table[(color >> 16) & 255] + belowTable[(below >> 16) & 255])
+        green = min(255, table[(color >> 8) & 255] + belowTable[(below >> 8) & 255])
+        blue = min(255, table[color & 255] + belowTable[below & 255])
+        out[i] = (white << 24) | (red << 16) | (green << 8) | blue
@@ -1,108 +1,510 @@
 #!/usr/bin/env python
 
-import requests
 import json
 import time
+import random
 import asyncio
+import logging
 import websockets
-from threading import Thread
+from collections import deque
+from httpclient import HttpConnectionPool, HttpError
+from playerevents import createEvent
+from playerstate import PlayerState, STATE_EVENTS
+from threading import Thread, Lock, Condition
 
-WS_URI = "ws://127.0.0.1:8082/events"
+API_HOST = "127.0.0.1"
+API_PORT = 8082
+WS_PATH = "/events"
+COMMAND_TIMEOUT = 5      # Seconds cleanup() waits for queued commands
+MAX_QUEUED_COMMANDS = 8  # Oldest commands are dropped beyond this
+LATENCY_HISTORY = 256    # Number of round trip times kept per command
+VOLUME_COALESCE_TIME = 0.05 # Seconds volume steps are collected before they are sent as one command
+VOLUME_STEPS = 64        # Steps from silent to full volume, librespot's volume-steps setting
+MAX_VOLUME = 65536       # Absolute volume of librespot's API at full volume
+EVENT_QUEUE_SIZE = 64    # Events waiting for their handlers, newer ones are dropped beyond this
+# Only the latest pending event of these types is kept for the handlers. At most one of
+# each is pending, so they are not dropped when the queue is full.
+COALESCED_EVENTS = frozenset(["volumeChanged"])
+# Never dropped, even beyond EVENT_QUEUE_SIZE
+ESSENTIAL_EVENTS = frozenset(["connection", "contextChanged"])
+SLOW_HANDLER_TIME = 0.1  # Handlers taking longer than this in seconds are logged
+LOOP_LAG_INTERVAL = 0.5  # Seconds between two loop lag measurements
+SLOW_LOOP_LAG = 0.05     # Loop lag above this in seconds is logged
+RECONNECT_MIN_DELAY = 0.5 # Seconds, first retry after the player could not be reached
+RECONNECT_MAX_DELAY = 30 # Upper bound of the doubling retry delay
+RECONNECT_STABLE_TIME = 10 # Seconds a connection has to stay up before the retry delay starts over
+# Seconds a command waits for the player to come back before it is dropped
+COMMAND_TTL = {"play": 30, "pause": 10, "skip": 5, "volume": 10}
+
+class TimingStats():
+    """Durations and failures of one kind of work, like a player command or an event handler."""
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.failed = 0
+        self.durations = deque(maxlen=LATENCY_HISTORY)
+
+    def record(self, duration, failed=False):
+        self.count += 1
+        self.durations.append(duration)
+        if failed:
+            self.failed += 1
+
+    def recordFailure(self):
+        self.count += 1
+        self.failed += 1
+
+    def percentiles(self, percents=(50, 90, 99)):
+        durations = sorted(self.durations)
+        if not durations:
+            return {}
+        return {percent: durations[min(len(durations) - 1, int(len(durations) * percent / 100))] for percent in percents}
+
+    def summary(self):
+        return {"count": self.count, "failed": self.failed, "duration": self.percentiles()}
 
 class Player(Thread):
 
     async def __wsOpen(self):
+        if self.disconnectedSince is not None:
+            downtime = time.monotonic() - self.disconnectedSince
+            self.reconnectStats.record(downtime)
+            logging.info("Player connection back after " + str(round(downtime, 1)) + "s")
+        self.disconnectedSince = None
         self.connected = True
-        self.connectionCallback(True)
+        self.connectedEvent.set()
+        self.__updateState(connected=True)
+        self.__dispatch("connection", [self.connectionCallback], True)
 
     async def __wsClose(self):
+        self.disconnectedSince = time.monotonic()
         self.connected = False
-        self.connectionCallback(False)
+        self.connectedEvent.clear()
+        self.__updateState(connected=False)
+        self.__dispatch("connection", [self.connectionCallback], False)
 
     async def __wsMessage(self, message):
-        messageDict = json.loads(message)
-        eventType = messageDict["event"]
-        if eventType == "contextChanged":
-            self.nowplaying = messageDict["uri"]
-        self.messageCallback(message)
+        try:
+            data = json.loads(message)
+            eventType = data.get("event")
+            handlers = self.handlers.get(eventType)
+            if handlers is None and eventType not in STATE_EVENTS:
+                return
+            logging.debug("Player event " + str(eventType))
+            event = createEvent(eventType, data)
+        except (ValueError, AttributeError, TypeError) as e:
+            # Not JSON, not an object or fields of the wrong type: skip it, the next one may be fine
+            logging.warning("Ignoring malformed player message: " + str(e))
+            return
+        if eventType in STATE_EVENTS:
+            self.__updateState(event)
+        if handlers is not None:
+            self.__dispatch(eventType, handlers, event)
+
+    def __dispatch(self, name, handlers, argument):
+        """Hand the event to the handler thread, so handlers that block do not keep the loop
+        from reading the websocket."""
+        with self.eventsReady:
+            if name in COALESCED_EVENTS:
+                for pending in self.events:
+                    if pending is not None and pending[1] == name:
+                        self.events.remove(pending)
+                        self.eventsMerged += 1
+                        break
+            elif len(self.events) >= EVENT_QUEUE_SIZE and name not in ESSENTIAL_EVENTS:
+                self.eventsDropped += 1
+                logging.warning("Player event queue is full. Dropping " + name)
+                return
+            self.events.append((time.monotonic(), name, handlers, argument))
+            self.eventsReady.notify()
+
+    def __runHandlers(self):
+        while True:
+            with self.eventsReady:
+                while not self.events:
+                    self.eventsReady.wait()
+                item = self.events.popleft()
+            if item is None:
+                return
+            queued, name, handlers, argument = item
+            start = time.monotonic()
+            failed = False
+            for handler in handlers:
+                try:
+                    handler(argument)
+                except Exception as e:
+                    failed = True
+                    logging.warning("Handler for player event " + name + " failed: " + str(e))
+            duration = time.monotonic() - start
+            self.__stats(self.handlerStats, name).record(duration, failed)
+            self.__stats(self.handlerStats, "queued").record(start - queued)
+            if duration > SLOW_HANDLER_TIME:
+                logging.warning("Handler for player event " + name + " took " + str(round(duration * 1000)) + "ms")
+
+    async def __measureLoopLag(self):
+        """The loop is late by as much as something kept it busy."""
+        while True:
+            expected = time.monotonic() + LOOP_LAG_INTERVAL
+            await asyncio.sleep(LOOP_LAG_INTERVAL)
+            lag = max(0, time.monotonic() - expected)
+            self.__stats(self.handlerStats, "loop lag").record(lag)
+            if lag > SLOW_LOOP_LAG:
+                logging.warning("Player loop lagged by " + str(round(lag * 1000)) + "ms")
 
-    def __init__(self, messageCallback, connectionCallback):
+    def __stats(self, table, name):
+        if name not in table:
+            table[name] = TimingStats(name)
+        return table[name]
+
+    def __init__(self, connectionCallback, host=API_HOST, port=API_PORT):
         Thread.__init__(self, daemon=True)
-        self.nowplaying = ""
-        self.messageCallback = messageCallback
+        self.host = host
+        self.port = port
+        # Event type -> handlers, called with the typed event on the player loop
+        self.handlers = {}
         self.connectionCallback = connectionCallback
         self.connected = False
+        self.connectedEvent = None
+        # time.monotonic() when the connection was lost, None while connected or before the first one
+        self.disconnectedSince = None
+        self.reconnectAttempts = 0
+        self.reconnectStats = TimingStats("reconnect")
+        self.loop = None
+        self.api = None
+        self.commandStats = {}
+        # Handlers run on their own thread in the order the events arrived
+        self.events = deque()
+        self.eventsReady = Condition()
+        self.eventsDropped = 0
+        self.eventsMerged = 0
+        self.handlerStats = {}
+        self.handlerThread = Thread(target=self.__runHandlers, daemon=True)
+        # Mirror of the player state, changed by the player loop only
+        self.state = PlayerState()
+        self.stateLock = Lock()
+        self.subscribers = []
+        # Volume the pending volume changes build on, between 0 and 1
+        self.volumeTarget = None
+        self.volumeSteps = 0
+        self.volumeStepTime = 0
+        self.volumeFlushScheduled = False
+        self.volumeLock = Lock()
+        # Commands waiting to be sent as [name, path, skips, queued at, buffered while disconnected],
+        # drained by one task on the loop
+        self.commands = deque()
+        self.commandLock = Lock()
+        self.commandsReady = None
+        self.commandBusy = False
+        self.commandsMerged = 0
+        self.commandsDropped = 0
+        self.commandsBuffered = 0
+        self.commandsReplayed = 0
+        self.commandsExpired = 0
 
     def run(self):
+        self.handlerThread.start()
         asyncio.run(self.listenToPlayer())
 
     async def listenToPlayer(self):
+        # Commands are sent from this loop over a pool of keep-alive connections
+        self.api = HttpConnectionPool(self.host, self.port)
+        self.commandsReady = asyncio.Event()
+        self.connectedEvent = asyncio.Event()
         try:
-            self.listeningTask = asyncio.create_task(self.__listen(WS_URI))
+            self.commandTask = asyncio.create_task(self.__runCommands())
+            self.lagTask = asyncio.create_task(self.__measureLoopLag())
+            self.listeningTask = asyncio.create_task(self.__listen("ws://" + self.host + ":" + str(self.port) + WS_PATH))
+            self.loop = asyncio.get_running_loop()
             await self.listeningTask
         except asyncio.exceptions.CancelledError:
             # shutting down
             return
+        finally:
+            self.api.close()
 
     async def __listen(self, uri):
-        async for websocket in websockets.connect(uri, ping_interval=None, ping_timeout=None):
+        delay = RECONNECT_MIN_DELAY
+        while True:
+            try:
+                websocket = await websockets.connect(uri, ping_interval=None, ping_timeout=None)
+            except (OSError, asyncio.TimeoutError, websockets.WebSocketException) as e:
+                self.reconnectAttempts += 1
+                delay = await self.__backoff(delay, "Player not reachable: " + str(e))
+                continue
+            connectedSince = time.monotonic()
             await self.__wsOpen()
             try:
                 async for message in websocket:
                     await self.__wsMessage(message)
             except websockets.ConnectionClosed:
-                await self.__wsClose()
-                continue
+                pass
             except asyncio.exceptions.CancelledError:
                 print("Shutting down. Disconnecting websocket")
                 await websocket.close()
                 raise
+            except Exception as e:
+                # A bug in handling one message must not end the reconnect loop
+                logging.error("Player connection failed: " + str(e) + ". Reconnecting")
+                await websocket.close()
+            await self.__wsClose()
+            # A player that accepts and then drops the connection right away keeps the delay growing
+            if time.monotonic() - connectedSince >= RECONNECT_STABLE_TIME:
+                delay = RECONNECT_MIN_DELAY
+            delay = await self.__backoff(delay, "Player connection closed")
+
+    async def __backoff(self, delay, reason):
+        """Sleep a random time up to delay before the next connection attempt. Full jitter, so
+        the box does not retry in lockstep with a restarting player. Returns the next delay."""
+        wait = random.uniform(0, delay)
+        logging.debug(reason + ". Retrying in " + str(round(wait, 2)) + "s")
+        await asyncio.sleep(wait)
+        return min(RECONNECT_MAX_DELAY, delay * 2)
+
+    def __enqueue(self, name, path=None, skips=0):
+        """Queue a command for the player loop and return right away. Can be called from any
+        thread. While the player is not connected, commands wait for it up to their COMMAND_TTL."""
+        if self.loop is None:
+            return
+        with self.commandLock:
+            if not self.connected:
+                self.commandsBuffered += 1
+            self.__merge(name, path, skips, not self.connected)
+        self.loop.call_soon_threadsafe(self.commandsReady.set)
+
+    def __merge(self, name, path, skips, buffered):
+        """Collapse the command into the queue: skips add up, the latest play replaces the
+        commands it makes pointless and repeated commands are sent once. Call with commandLock held."""
+        commands = self.commands
+        last = commands[-1] if commands else None
+        if name == "skip":
+            if last is not None and last[0] == "skip":
+                last[2] += skips
+                last[3] = time.monotonic()
+                if last[2] == 0:
+                    # Next and previous cancel each other out
+                    commands.pop()
+                self.commandsMerged += 1
+                return
+        elif name == "play":
+            # Loading a new context undoes queued skips and pauses as well
+            for command in [command for command in commands if command[0] in ("play", "pause", "skip")]:
+                commands.remove(command)
+                self.commandsMerged += 1
+        elif last is not None and last[0] == name and last[1] == path:
+            self.commandsMerged += 1
+            return
+        if len(commands) >= MAX_QUEUED_COMMANDS:
+            dropped = commands.popleft()
+            self.commandsDropped += 1
+            logging.warning("Player command queue is full. Dropping " + dropped[0])
+        commands.append([name, path, skips, time.monotonic(), buffered])
+
+    async def __runCommands(self):
+        while True:
+            await self.commandsReady.wait()
+            if not self.connected:
+                await self.connectedEvent.wait()
+            with self.commandLock:
+                if not self.commands:
+                    self.commandsReady.clear()
+                    continue
+                name, path, skips, queued, buffered = self.commands.popleft()
+                if time.monotonic() - queued > COMMAND_TTL[name]:
+                    self.commandsExpired += 1
+                    logging.info("Dropping player command " + name + ", it waited too long for the player")
+                    continue
+                if buffered:
+                    self.commandsReplayed += 1
+                self.commandBusy = True
+            try:
+                if name == "skip":
+                    # The player skips one track per command
+                    for i in range(abs(skips)):
+                        await self.__send("next" if skips > 0 else "prev", "/player/next" if skips > 0 else "/player/prev")
+                else:
+                    await self.__send(name, path)
+            finally:
+                self.commandBusy = False
+
+    async def __waitForCommands(self):
+        while self.commands or self.commandBusy:
+            await asyncio.sleep(0.01)
+
+    async def __send(self, name, path):
+        stats = self.__stats(self.commandStats, name)
+        start = time.monotonic()
+        try:
+            status, body = await self.api.post(path)
+        except (OSError, HttpError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+            stats.recordFailure()
+            logging.warning("Player command " + name + " failed: " + str(e))
+            return
+        latency = time.monotonic() - start
+        stats.record(latency)
+        logging.debug("Player command " + name + " took " + str(round(latency * 1000, 1)) + "ms")
+        if status >= 400:
+            logging.warning("Player command " + name + " returned " + str(status) + ": " + body.decode("utf-8", "replace"))
+
+    def __updateState(self, event=None, **values):
+        """Apply an event or field values and notify the subscribers of changed fields."""
+        with self.stateLock:
+            changed = self.state.update(event) if event is not None else self.state.set(**values)
+            if not changed:
+                return
+            snapshot = self.state.copy()
+        for callback, fields in list(self.subscribers):
+            if fields is None or not fields.isdisjoint(changed):
+                try:
+                    callback(snapshot, changed)
+                except Exception as e:
+                    logging.warning("Player state subscriber failed: " + str(e))
+
+    def on(self, eventType, handler):
+        """Call handler(event) for every event of eventType. Events nobody handles and the
+        state does not need are dropped right after decoding."""
+        self.handlers.setdefault(eventType, []).append(handler)
+
+    def snapshot(self):
+        """Consistent copy of the player state. Can be called from any thread."""
+        with self.stateLock:
+            return self.state.copy()
+
+    def subscribe(self, callback, fields=None):
+        """Call callback(snapshot, changedFields) on the player loop whenever one of fields,
+        or any field if None, changes. Callbacks must not block."""
+        self.subscribers.append((callback, None if fields is None else frozenset(fields)))
+
+    def unsubscribe(self, callback):
+        self.subscribers = [subscriber for subscriber in self.subscribers if subscriber[0] != callback]
+
+    def getCommandStats(self):
+        """Number of commands, failures and round trip percentiles per command."""
+        return {name: stats.summary() for name, stats in list(self.commandStats.items())}
+
+    def getHandlerStats(self):
+        """Time spent per event handler, time events waited for the handler thread and loop lag."""
+        return {name: stats.summary() for name, stats in list(self.handlerStats.items())}
+
+    def getQueueCounters(self):
+        """Number of commands merged into queued ones and dropped because the queue was full."""
+        return self.commandsMerged, self.commandsDropped
+
+    def getConnectionStats(self):
+        """Failed connection attempts, count and percentiles of the time it took to get back to
+        the player, and the number of commands buffered while disconnected, replayed and expired."""
+        return self.reconnectAttempts, self.reconnectStats.summary(), self.commandsBuffered, self.commandsReplayed, self.commandsExpired
 
     def play(self, uri):
-        if self.nowplaying != uri:
-            if self.connected:
-                requests.post("http://127.0.0.1:8082/player/load?uri=" + uri + "&play=true&shuffle=false")
+        if self.snapshot().context != uri:
+            self.__enqueue("play", "/player/load?uri=" + uri + "&play=true&shuffle=false")
 
     def pause(self):
-        if self.connected:
-            print("Pausing playback")
-            requests.post("http://127.0.0.1:8082/player/pause")
+        print("Pausing playback")
+        self.__enqueue("pause", "/player/pause")
 
     def next(self):
-        if self.connected:
-            print("Playing next song")
-            requests.post("http://127.0.0.1:8082/player/next")
+        print("Playing next song")
+        self.__enqueue("skip", skips=1)
 
     def prev(self):
-        if self.connected:
-            print("Playing previous song")
-            requests.post("http://127.0.0.1:8082/player/prev")
+        print("Playing previous song")
+        self.__enqueue("skip", skips=-1)
+
+    def changeVolume(self, steps):
+        """Change the volume by steps, negative ones turn it down. Does not wait. Steps within
+        VOLUME_COALESCE_TIME, or while the previous change is still being sent, go out as one command."""
+        if self.loop is None:
+            return
+        with self.volumeLock:
+            self.volumeSteps += steps
+            self.volumeStepTime = time.monotonic()
+            if self.volumeFlushScheduled:
+                return
+            self.volumeFlushScheduled = True
+        asyncio.run_coroutine_threadsafe(self.__flushVolume(), self.loop)
 
     def increaseVolume(self):
-        if self.connected:
-            print("Increasing volume by 1 step")
-            requests.post("http://127.0.0.1:8082/player/set-volume?step=1")
+        self.changeVolume(1)
 
     def decreaseVolume(self):
-        if self.connected:
-            print("Dereasing volume by 1 step")
-            requests.post("http://127.0.0.1:8082/player/set-volume?step=-1")
+        self.changeVolume(-1)
+
+    async def __flushVolume(self):
+        await asyncio.sleep(VOLUME_COALESCE_TIME)
+        while True:
+            buffered = not self.connected
+            if buffered:
+                self.commandsBuffered += 1
+                await self.connectedEvent.wait()
+            with self.volumeLock:
+                steps = self.volumeSteps
+                self.volumeSteps = 0
+                if steps != 0 and time.monotonic() - self.volumeStepTime > COMMAND_TTL["volume"]:
+                    self.commandsExpired += 1
+                    logging.info("Dropping volume change, it waited too long for the player")
+                    steps = 0
+                elif steps != 0 and buffered:
+                    self.commandsReplayed += 1
+                if steps == 0:
+                    self.volumeFlushScheduled = False
+                    self.volumeTarget = None
+                    return
+                path = self.__volumePath(steps)
+            logging.debug("Changing volume by " + str(steps) + " steps")
+            await self.__send("volume", path)
+
+    def __volumePath(self, steps):
+        """Absolute volume once it is known, so only the latest target counts. Relative before.
+        Within one burst of changes the target builds on itself, volume events of commands
+        still in flight would undo steps that are not sent yet."""
+        if self.volumeTarget is None:
+            self.volumeTarget = self.snapshot().volume
+        if self.volumeTarget is None:
+            return "/player/set-volume?step=" + str(steps)
+        self.volumeTarget = min(1, max(0, self.volumeTarget + steps / VOLUME_STEPS))
+        return "/player/set-volume?volume=" + str(round(self.volumeTarget * MAX_VOLUME))
 
     def cleanup(self):
-        self.listeningTask.cancel()
-        self.pause()
+        if self.loop is not None:
+            # Pause while the loop still runs, the command is sent from it. Nothing can be
+            # sent while the player is away, so do not leave it to play on once it is back.
+            if self.connected:
+                self.pause()
+                try:
+                    asyncio.run_coroutine_threadsafe(self.__waitForCommands(), self.loop).result(COMMAND_TIMEOUT)
+                except Exception:
+                    logging.warning("Player commands still queued at shutdown: " + str(len(self.commands)))
+            self.loop.call_soon_threadsafe(self.listeningTask.cancel)
+        with self.eventsReady:
+            # Stops the handler thread once the pending events are handled, however many there are
+            self.events.append(None)
+            self.eventsReady.notify()
+        merged, dropped = self.getQueueCounters()
+        logging.debug("Player commands merged: " + str(merged) + ", dropped: " + str(dropped) + ". Events merged: " + str(self.eventsMerged) + ", dropped: " + str(self.eventsDropped))
+        attempts, reconnects, buffered, replayed, expired = self.getConnectionStats()
+        logging.debug("Player connection attempts failed: " + str(attempts) + ", reconnects: " + str(reconnects) +
+                      ". Commands buffered: " + str(buffered) + ", replayed: " + str(replayed) + ", expired: " + str(expired))
+        for name, stats in self.getCommandStats().items():
+            logging.debug("Player command " + name + ": " + str(stats))
+        for name, stats in self.getHandlerStats().items():
+            logging.debug("Player event " + name + ": " + str(stats))
+
+# Without librespot-java, start the stand-in first: python standin.py
+# Latencies and event throughput are measured by bench_player.py
 
 # class Callback():
 #     def onConnection(self, connected):
 #         print("Connected: " + str(connected))
     
-#     def onMessage(self, message):
-#         print("Message: " + message)
+#     def onVolume(self, event):
+#         print("Volume: " + str(event.value))
 
 # if __name__ == '__main__':
 
 #     cb = Callback()
-#     p = Player(cb.onMessage, cb.onConnection)
+#     p = Player(cb.onConnection)
+#     p.on("volumeChanged", cb.onVolume)
 #     p.start()
 
 #     print("Sleeping for half a minute")
@@ -110,4 +512,3 @@ class Player(Thread):
 
 #     print("Cleaning up")
 #     p.cleanup()
-    
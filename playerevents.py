@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+class PlayerEvent():
+    """Websocket event of the player. Event types without fields we use stay this class."""
+
+    __slots__ = ("type",)
+
+    def __init__(self, eventType, data):
+        self.type = eventType
+
+    def __repr__(self):
+        slots = [name for cls in type(self).__mro__ for name in getattr(cls, "__slots__", ())]
+        return type(self).__name__ + "(" + ", ".join(name + "=" + repr(getattr(self, name)) for name in slots) + ")"
+
+class ContextChanged(PlayerEvent):
+
+    __slots__ = ("uri",)
+
+    def __init__(self, eventType, data):
+        PlayerEvent.__init__(self, eventType, data)
+        self.uri = data.get("uri")
+
+class TrackChanged(PlayerEvent):
+
+    __slots__ = ("uri",)
+
+    def __init__(self, eventType, data):
+        PlayerEvent.__init__(self, eventType, data)
+        self.uri = data.get("uri")
+
+class MetadataAvailable(PlayerEvent):
+
+    __slots__ = ("title", "artists", "album", "duration")
+
+    def __init__(self, eventType, data):
+        PlayerEvent.__init__(self, eventType, data)
+        track = data.get("track") or {}
+        self.title = track.get("name")
+        self.artists = tuple(artist.get("name") for artist in track.get("artist", []))
+        self.album = (track.get("album") or {}).get("name")
+        self.duration = track.get("duration")
+
+class PlaybackChanged(PlayerEvent):
+    """Paused, resumed, ended or seeked. trackTime is the position in milliseconds if reported."""
+
+    __slots__ = ("trackTime",)
+
+    def __init__(self, eventType, data):
+        PlayerEvent.__init__(self, eventType, data)
+        self.trackTime = data.get("trackTime")
+
+class PlaybackHaltStateChanged(PlaybackChanged):
+
+    __slots__ = ("halted",)
+
+    def __init__(self, eventType, data):
+        PlaybackChanged.__init__(self, eventType, data)
+        self.halted = bool(data.get("halted"))
+
+class VolumeChanged(PlayerEvent):
+
+    __slots__ = ("value",)
+
+    def __init__(self, eventType, data):
+        PlayerEvent.__init__(self, eventType, data)
+        # Between 0 and 1
+        self.value = data.get("value")
+
+EVENT_TYPES = {
+    "contextChanged": ContextChanged,
+    "trackChanged": TrackChanged,
+    "metadataAvailable": MetadataAvailable,
+    "playbackPaused": PlaybackChanged,
+    "playbackResumed": PlaybackChanged,
+    "playbackEnded": PlaybackChanged,
+    "trackSeeked": PlaybackChanged,
+    "playbackHaltStateChanged": PlaybackHaltStateChanged,
+    "volumeChanged": VolumeChanged,
+}
+
+def createEvent(eventType, data):
+    """Typed event for a decoded message."""
+    return EVENT_TYPES.get(eventType, PlayerEvent)(eventType, data)
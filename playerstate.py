@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+import time
+
+# Event types the state is updated from
+STATE_EVENTS = frozenset(["contextChanged", "trackChanged", "metadataAvailable", "playbackPaused", "playbackEnded",
+                          "playbackResumed", "trackSeeked", "playbackHaltStateChanged", "volumeChanged", "sessionCleared", "inactiveSession"])
+
+class PlayerState():
+    """Everything known about the player, mirrored from its websocket events. Times are
+    in milliseconds like in the events, trackTimeUpdated is a time.monotonic() value."""
+
+    __slots__ = ("connected", "context", "track", "title", "artists", "album", "duration",
+                 "playing", "halted", "volume", "trackTime", "trackTimeUpdated")
+
+    def __init__(self):
+        self.connected = False
+        self.context = None
+        self.track = None
+        self.title = None
+        self.artists = None
+        self.album = None
+        self.duration = None
+        self.playing = None
+        self.halted = False
+        # Between 0 and 1, None until the player reported it
+        self.volume = None
+        self.trackTime = None
+        self.trackTimeUpdated = None
+
+    def copy(self):
+        state = PlayerState()
+        for name in self.__slots__:
+            setattr(state, name, getattr(self, name))
+        return state
+
+    def position(self):
+        """Estimated playback position in milliseconds, None if unknown."""
+        if self.trackTime is None:
+            return None
+        if not self.playing or self.halted:
+            return self.trackTime
+        return self.trackTime + int((time.monotonic() - self.trackTimeUpdated) * 1000)
+
+    def set(self, **values):
+        """Set fields and return the names of the ones that changed."""
+        changed = set()
+        for name, value in values.items():
+            if getattr(self, name) != value:
+                setattr(self, name, value)
+                changed.add(name)
+        return changed
+
+    def update(self, event):
+        """Apply a typed player event. Returns the names of the fields that changed."""
+        eventType = event.type
+        trackTime = getattr(event, "trackTime", None)
+        if trackTime is not None:
+            # The position moves on its own while playing, so it is not reported as a change
+            self.trackTime = trackTime
+            self.trackTimeUpdated = time.monotonic()
+        if eventType == "contextChanged":
+            return self.set(context=event.uri)
+        if eventType == "trackChanged":
+            self.trackTime = 0
+            self.trackTimeUpdated = time.monotonic()
+            return self.set(track=event.uri)
+        if eventType == "metadataAvailable":
+            return self.set(title=event.title, artists=event.artists, album=event.album, duration=event.duration)
+        if eventType == "playbackPaused" or eventType == "playbackEnded":
+            return self.set(playing=False)
+        if eventType == "playbackResumed":
+            return self.set(playing=True, halted=False)
+        if eventType == "playbackHaltStateChanged":
+            return self.set(halted=event.halted)
+        if eventType == "volumeChanged":
+            return self.set(volume=event.value)
+        if eventType == "sessionCleared" or eventType == "inactiveSession":
+            return self.set(playing=False)
+        return set()
+
+    def __repr__(self):
+        return "PlayerState(" + ", ".join(name + "=" + repr(getattr(self, name)) for name in self.__slots__) + ")"
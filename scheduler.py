@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+import time
+from collections import deque
+
+MISSED_DEADLINE_TOLERANCE = 0.005 # In seconds
+FRAME_TIME_HISTORY = 512          # Number of frame times kept per animation
+
+class FrameStats():
+    """Deadline misses, dropped frames and actual frame times of one animation."""
+
+    def __init__(self, name):
+        self.name = name
+        self.frames = 0
+        self.missed = 0
+        self.dropped = 0
+        self.frameTimes = deque(maxlen=FRAME_TIME_HISTORY)
+        self.lastFrame = None
+
+    def recordFrame(self, now, lateness, dropped):
+        if lateness > MISSED_DEADLINE_TOLERANCE:
+            self.missed += 1
+        self.dropped += dropped
+        self.frames += 1
+        if self.lastFrame is not None:
+            self.frameTimes.append(now - self.lastFrame)
+        self.lastFrame = now
+
+    def restart(self):
+        """A new run of the animation starts, the pause before it is not a frame time."""
+        self.lastFrame = None
+
+    def percentiles(self, percents=(50, 90, 99)):
+        frameTimes = sorted(self.frameTimes)
+        if not frameTimes:
+            return {}
+        return {percent: frameTimes[min(len(frameTimes) - 1, int(len(frameTimes) * percent / 100))] for percent in percents}
+
+    def summary(self):
+        return {"frames": self.frames, "missed": self.missed, "dropped": self.dropped, "frameTimes": self.percentiles()}
+
+class FrameScheduler():
+    """Plays a frame generator yielding (pixels, brightness, seconds) on time.monotonic()
+    deadlines. Deadlines are accumulated instead of measured from the end of the previous
+    frame, so the time spent rendering does not stretch the animation. Frames that are due
+    less than one target frame period apart are dropped, which also applies when the
+    renderer falls behind."""
+
+    def __init__(self, frames, fps, stats):
+        self.frames = frames
+        self.period = 1.0 / fps
+        self.stats = stats
+        self.stats.restart()
+        now = time.monotonic()
+        self.frameDeadline = now
+        self.displayDeadline = now
+        self.current = None
+
+    def nextDeadline(self):
+        return max(self.frameDeadline, self.displayDeadline)
+
+    def advance(self, now):
+        """Step to the latest frame that is due. Returns False once the generator is exhausted."""
+        lateness = now - self.nextDeadline()
+        stepped = 0
+        while self.frameDeadline <= now:
+            try:
+                self.current = next(self.frames)
+            except StopIteration:
+                return False
+            self.frameDeadline += self.current[2]
+            stepped += 1
+        self.displayDeadline += self.period
+        if self.displayDeadline <= now:
+            self.displayDeadline = now + self.period
+        self.stats.recordFrame(now, lateness, max(0, stepped - 1))
+        return True
+
+    def close(self):
+        self.frames.close()
+
+class Deadline():
+    """Fixed rate timer for simple loops: waiting for the next tick does not drift. If the
+    loop falls behind by more than one tick it skips ahead instead of catching up."""
+
+    def __init__(self):
+        self.time = time.monotonic()
+
+    def wait(self, event, seconds):
+        """Wait on event until seconds after the previous deadline. Returns the event flag."""
+        self.time += seconds
+        now = time.monotonic()
+        if self.time + seconds < now:
+            self.time = now
+        return event.wait(max(0, self.time - now))
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+
+import time
+import logging
+from meter import IDLE_TIME, STALE_TIME
+from fifo import FifoReader
+from scheduler import Deadline
+from threading import Event, Thread
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+PCM_PIPE = '/home/comitup/pcm'
+SAMPLE_RATE = 44100      # Also works with 48000, must match the writer
+CHANNELS = 2             # Interleaved signed 16 bit little endian samples
+SAMPLE_SIZE = 2
+BLOCK_SIZE = 1024        # FFT size in samples after decimation
+OVERLAP = 0.5            # Share of a block that is reused by the next one
+DECIMATION = 2           # Keep every n-th sample (averaged), the bands hardly need more than 11 kHz
+MIN_FREQUENCY = 40       # Lower edge of the lowest band in Hz
+MAX_FREQUENCY = 16000    # Upper edge of the highest band, limited by the decimated sample rate
+FLOOR_DB = -60           # Band power shown as 0%, full scale is 100%
+BAND_RELEASE_TIME = 0.3  # Seconds for a band to fall ~63% towards a lower level
+UPDATE_INTERVAL = 0.033  # Minimum time between two callbacks
+
+class SpectrumAnalyzer():
+    """Windowed FFT over overlapping blocks of raw PCM, reduced to logarithmically spaced
+    bands in percent. Only the newest block is analyzed if more than one hop of samples
+    arrives at once, so a late reader catches up instead of falling further behind."""
+
+    def __init__(self, bands, sampleRate=SAMPLE_RATE, blockSize=BLOCK_SIZE, overlap=OVERLAP, decimation=DECIMATION):
+        if numpy is None:
+            raise RuntimeError("The spectrum analyzer needs NumPy")
+        self.blockSize = blockSize
+        self.decimation = decimation
+        self.hop = max(1, int(blockSize * (1 - overlap)))
+        rate = sampleRate / decimation
+        self.hopTime = self.hop / rate
+        self.window = numpy.hanning(blockSize).astype(numpy.float32)
+        # Power of a full scale sine in its FFT bin, after windowing
+        self.reference = (numpy.sum(self.window) / 2) ** 2
+        self.block = numpy.zeros(blockSize, dtype=numpy.float32)
+        self.fresh = numpy.zeros(0, dtype=numpy.float32)
+        self.leftover = numpy.zeros(0, dtype=numpy.float32)
+        # First FFT bin of every band plus the end of the last one. Every band gets at least one bin
+        frequencies = numpy.fft.rfftfreq(blockSize, 1 / rate)
+        edges = numpy.geomspace(MIN_FREQUENCY, min(MAX_FREQUENCY, rate / 2), bands + 1)
+        bins = numpy.searchsorted(frequencies, edges)
+        for i in range(1, len(bins)):
+            bins[i] = max(bins[i], bins[i - 1] + 1)
+        if bins[-2] >= len(frequencies):
+            raise ValueError("Block size " + str(blockSize) + " is too small for " + str(bands) + " bands")
+        self.bandStarts = bins[:-1]
+        self.bandEnd = min(bins[-1], len(frequencies))
+        self.bandWidths = numpy.diff(numpy.minimum(bins, len(frequencies))).clip(1)
+        self.bands = numpy.zeros(bands, dtype=numpy.float32)
+        self.levels = (0.0, 0.0)
+
+    def add(self, pcm):
+        """Add complete frames of interleaved PCM. Returns True if the bands were updated."""
+        samples = numpy.frombuffer(pcm, dtype='<i2').reshape(-1, CHANNELS)
+        if not len(samples):
+            return False
+        samples = samples.astype(numpy.float32) * (1 / 32768)
+        self.levels = tuple(float(level) * 100 for level in numpy.sqrt(numpy.mean(numpy.square(samples), axis=0)))
+        mono = numpy.concatenate((self.leftover, samples.mean(axis=1)))
+        usable = len(mono) - len(mono) % self.decimation
+        self.leftover = mono[usable:]
+        self.fresh = numpy.concatenate((self.fresh, mono[:usable].reshape(-1, self.decimation).mean(axis=1)))
+        hops = len(self.fresh) // self.hop
+        if not hops:
+            return False
+        shift = hops * self.hop
+        if shift >= self.blockSize:
+            self.block[:] = self.fresh[shift - self.blockSize:shift]
+        else:
+            self.block[:-shift] = self.block[shift:]
+            self.block[-shift:] = self.fresh[:shift]
+        self.fresh = self.fresh[shift:]
+        self.__analyze(hops * self.hopTime)
+        return True
+
+    def __analyze(self, elapsed):
+        power = numpy.square(numpy.abs(numpy.fft.rfft(self.block * self.window)))
+        power = numpy.add.reduceat(power[:self.bandEnd], self.bandStarts)[:len(self.bands)] / self.bandWidths
+        decibels = 10 * numpy.log10(power / self.reference + 1e-12)
+        bands = numpy.clip((decibels - FLOOR_DB) * (100 / -FLOOR_DB), 0, 100)
+        # Rise at once, fall slowly, so short beats stay visible
+        fallen = self.bands * numpy.exp(-elapsed / BAND_RELEASE_TIME)
+        numpy.maximum(bands, fallen, out=self.bands)
+
+    def decay(self, elapsed):
+        """No samples came in for elapsed seconds. The bands fall like after a quiet block."""
+        self.bands *= numpy.exp(-elapsed / BAND_RELEASE_TIME)
+        self.levels = (0.0, 0.0)
+
+class SpectrumMeter():
+    """Reads raw PCM from a named pipe or a file and calls callback(bands) with one level
+    in percent per band. levelCallback(left, right) gets the stereo levels in percent the
+    way Meter reports them. Files are read at the pace of the sample rate."""
+
+    def __init__(self, callback, bands, path=PCM_PIPE, levelCallback=None, idleCallback=None,
+                 sampleRate=SAMPLE_RATE, blockSize=BLOCK_SIZE, overlap=OVERLAP, decimation=DECIMATION):
+        self.analyzer = SpectrumAnalyzer(bands, sampleRate, blockSize, overlap, decimation)
+        self.callback = callback
+        self.levelCallback = levelCallback
+        self.idleCallback = idleCallback
+        self.path = path
+        self.sampleRate = sampleRate
+        self.frameSize = CHANNELS * SAMPLE_SIZE
+        # One hop of raw frames per read
+        self.fifo = FifoReader(path, self.analyzer.hop * decimation * self.frameSize, self.frameSize)
+        self.updated = False
+        self.cancel_event = Event()
+        self.idle = False
+        self.silentSince = None
+
+    def startMeter(self):
+        self.meterThread = Thread(target=self.__run, daemon = True)
+        self.meterThread.start()
+        return self.meterThread
+
+    def stopMeter(self):
+        self.cancel_event.set()
+        self.fifo.wake()
+
+    def setVolume(self, volume):
+        """ Same interface as Meter. Bands are scaled to full scale without auto gain, so the volume is not needed. """
+        pass
+
+    def __read(self, limit=None):
+        """ Feed up to limit buffers (all available data if None) to the analyzer. Returns
+        True if the bands changed and None once a file has been read to the end. """
+        self.updated = False
+        if self.fifo.read(self.__addBlock, limit) is None:
+            return None
+        return self.updated
+
+    def __addBlock(self, block):
+        self.updated = self.analyzer.add(block) or self.updated
+
+    def __report(self):
+        now = time.monotonic()
+        bands = [int(level) for level in self.analyzer.bands]
+        left, right = self.analyzer.levels
+        if any(bands) or int(left) or int(right):
+            self.idle = False
+            self.silentSince = None
+        elif self.idle:
+            return
+        elif self.silentSince is None:
+            self.silentSince = now
+        elif now - self.silentSince >= IDLE_TIME:
+            self.idle = True
+            if self.idleCallback is not None:
+                self.idleCallback()
+            return
+        self.callback(bands)
+        if self.levelCallback is not None:
+            self.levelCallback(int(left), int(right))
+
+    def __run(self):
+        if not self.fifo.isPipe:
+            self.__runFile()
+            return
+        lastUpdate = time.monotonic()
+        while True:
+            ready = self.fifo.wait(None if self.idle else STALE_TIME)
+            if ready is False:
+                break
+            now = time.monotonic()
+            if ready is None:
+                # The writer stopped or went away, let the bands fall and the meter go idle
+                self.analyzer.decay(now - lastUpdate)
+                lastUpdate = now
+                self.__report()
+            elif self.__read():
+                lastUpdate = now
+                self.__report()
+            # Samples that arrive in the meantime are analyzed in one go afterwards
+            if self.cancel_event.wait(UPDATE_INTERVAL):
+                break
+
+    def __runFile(self):
+        """ Plays back a file in real time, one hop per tick. """
+        deadline = Deadline()
+        hopTime = len(self.fifo.buffer) / self.frameSize / self.sampleRate
+        while True:
+            updated = self.__read(1)
+            if updated is None:
+                logging.debug("End of PCM file " + self.path)
+                break
+            if updated:
+                self.__report()
+            if deadline.wait(self.cancel_event, hopTime):
+                break
@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+
+# Stand-in for librespot-java's API: serves the /player/* commands the box uses and the
+# /events websocket on one port, with a configurable response delay and a stream of
+# synthetic events. Commands change a simulated player and send the events the real one
+# would. Run it on its own to try the box without librespot:
+#
+#   python standin.py --port 8082 --delay 0.02 --event-rate 10
+
+import sys
+import json
+import time
+import base64
+import random
+import asyncio
+import hashlib
+import logging
+import argparse
+from threading import Thread, Event
+from urllib.parse import urlsplit, parse_qs
+
+HOST = "127.0.0.1"
+PORT = 8082
+MAX_VOLUME = 65536
+VOLUME_STEPS = 64
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+class PlayerStandIn():
+
+    def __init__(self, host=HOST, port=PORT, responseDelay=0, eventRate=0, eventType="volumeChanged"):
+        self.host = host
+        self.port = port
+        self.responseDelay = responseDelay
+        self.eventRate = eventRate
+        self.eventType = eventType
+        # (time.monotonic() when the request arrived, path) of every command
+        self.requests = []
+        self.requestListeners = []
+        self.clients = set()
+        self.eventsSent = 0
+        self.context = None
+        self.track = 0
+        self.volume = MAX_VOLUME // 2
+        self.playing = False
+        self.loop = None
+        self.server = None
+        self.ready = Event()
+
+    def start(self):
+        """Serve from a background thread. Returns once the port is open."""
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+        self.ready.wait()
+        return self
+
+    def run(self):
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.mainTask = asyncio.current_task()
+        self.server = await asyncio.start_server(self.__handle, self.host, self.port)
+        # Port 0 picks a free one
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.ready.set()
+        tasks = [asyncio.create_task(self.server.serve_forever())]
+        if self.eventRate > 0:
+            tasks.append(asyncio.create_task(self.__emitEvents()))
+        try:
+            await asyncio.gather(*tasks)
+        except asyncio.CancelledError:
+            self.server.close()
+
+    def stop(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.mainTask.cancel)
+            self.thread.join()
+
+    def onRequest(self, listener):
+        """Call listener(arrival, path) on the server thread for every command."""
+        self.requestListeners.append(listener)
+
+    def burst(self, count, eventType=None, rate=None):
+        """Send count events, as fast as possible or at rate events per second. Can be called
+        from any thread, returns the time.monotonic() when sending started."""
+        return asyncio.run_coroutine_threadsafe(self.__burst(count, eventType or self.eventType, rate), self.loop).result()
+
+    async def __burst(self, count, eventType, rate):
+        start = time.monotonic()
+        for i in range(count):
+            if rate is not None:
+                await asyncio.sleep(max(0, start + i / rate - time.monotonic()))
+            await self.__broadcast(self.__syntheticEvent(eventType))
+        return start
+
+    async def __emitEvents(self):
+        period = 1.0 / self.eventRate
+        deadline = time.monotonic()
+        while True:
+            deadline += period
+            await asyncio.sleep(max(0, deadline - time.monotonic()))
+            await self.__broadcast(self.__syntheticEvent(self.eventType))
+
+    def __syntheticEvent(self, eventType):
+        if eventType == "volumeChanged":
+            return {"event": "volumeChanged", "value": self.volume / MAX_VOLUME}
+        if eventType == "trackSeeked":
+            return {"event": "trackSeeked", "trackTime": random.randint(0, 300000)}
+        return {"event": eventType}
+
+    async def __handle(self, reader, writer):
+        try:
+            while True:
+                request = await self.__readRequest(reader)
+                if request is None:
+                    break
+                method, target, headers = request
+                if headers.get("upgrade", "").lower() == "websocket":
+                    await self.__websocket(reader, writer, target, headers)
+                    break
+                await self.__command(writer, method, target)
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            # Client went away or the stand-in is stopping
+            pass
+        finally:
+            self.clients.discard(writer)
+            writer.close()
+
+    async def __readRequest(self, reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        method, target, version = line.decode("latin-1").split(" ", 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if int(headers.get("content-length", 0)):
+            await reader.readexactly(int(headers["content-length"]))
+        return method, target, headers
+
+    async def __respond(self, writer, status, reason, body=b""):
+        writer.write(("HTTP/1.1 " + str(status) + " " + reason + "\r\nContent-Type: application/json\r\nContent-Length: " + str(len(body)) + "\r\n\r\n").encode("ascii") + body)
+        await writer.drain()
+
+    async def __command(self, writer, method, target):
+        arrival = time.monotonic()
+        url = urlsplit(target)
+        self.requests.append((arrival, target))
+        for listener in self.requestListeners:
+            listener(arrival, target)
+        if self.responseDelay:
+            await asyncio.sleep(self.responseDelay)
+        if method != "POST" or not url.path.startswith("/player/"):
+            await self.__respond(writer, 404, "Not Found")
+            return
+        events = self.__execute(url.path[len("/player/"):], parse_qs(url.query))
+        if events is None:
+            await self.__respond(writer, 404, "Not Found")
+            return
+        await self.__respond(writer, 200, "OK", b"{}")
+        for event in events:
+            await self.__broadcast(event)
+
+    def __execute(self, command, query):
+        """Change the simulated player. Returns the events to send or None for an unknown command."""
+        if command == "load":
+            self.context = query.get("uri", [None])[0]
+            self.track = 0
+            self.playing = True
+            return [{"event": "contextChanged", "uri": self.context},
+                    {"event": "trackChanged", "uri": self.__trackUri()},
+                    {"event": "playbackResumed", "trackTime": 0}]
+        if command == "next" or command == "prev":
+            self.track = max(0, self.track + (1 if command == "next" else -1))
+            return [{"event": "trackChanged", "uri": self.__trackUri()}]
+        if command == "pause":
+            self.playing = False
+            return [{"event": "playbackPaused", "trackTime": 0}]
+        if command == "set-volume":
+            if "volume" in query:
+                self.volume = int(query["volume"][0])
+            elif "step" in query:
+                self.volume += int(query["step"][0]) * MAX_VOLUME // VOLUME_STEPS
+            self.volume = min(MAX_VOLUME, max(0, self.volume))
+            return [{"event": "volumeChanged", "value": self.volume / MAX_VOLUME}]
+        return None
+
+    def __trackUri(self):
+        return "spotify:track:standin" + str(self.track)
+
+    async def __websocket(self, reader, writer, target, headers):
+        if urlsplit(target).path != "/events":
+            await self.__respond(writer, 404, "Not Found")
+            return
+        accept = base64.b64encode(hashlib.sha1((headers.get("sec-websocket-key", "") + WEBSOCKET_GUID).encode("ascii")).digest()).decode("ascii")
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\nSec-WebSocket-Accept: " + accept + "\r\n\r\n").encode("ascii"))
+        await writer.drain()
+        self.clients.add(writer)
+        # Clients only send control frames to us
+        while True:
+            opcode, payload = await self.__readFrame(reader)
+            if opcode == 0x8:
+                writer.write(self.__frame(0x8, payload[:2]))
+                await writer.drain()
+                return
+            if opcode == 0x9:
+                writer.write(self.__frame(0xA, payload))
+
+    async def __readFrame(self, reader):
+        first, second = await reader.readexactly(2)
+        length = second & 0x7F
+        if length == 126:
+            length = int.from_bytes(await reader.readexactly(2), "big")
+        elif length == 127:
+            length = int.from_bytes(await reader.readexactly(8), "big")
+        mask = await reader.readexactly(4) if second & 0x80 else None
+        payload = await reader.readexactly(length)
+        if mask is not None:
+            payload = bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload))
+        return first & 0x0F, payload
+
+    def __frame(self, opcode, payload):
+        length = len(payload)
+        if length < 126:
+            header = bytes([0x80 | opcode, length])
+        elif length < 65536:
+            header = bytes([0x80 | opcode, 126]) + length.to_bytes(2, "big")
+        else:
+            header = bytes([0x80 | opcode, 127]) + length.to_bytes(8, "big")
+        return header + payload
+
+    async def __broadcast(self, event):
+        frame = self.__frame(0x1, json.dumps(event).encode("utf-8"))
+        for writer in list(self.clients):
+            try:
+                writer.write(frame)
+                await writer.drain()
+            except ConnectionError:
+                self.clients.discard(writer)
+        self.eventsSent += 1
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stand-in for the librespot-java API")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--delay", type=float, default=0, help="Seconds before every command is answered")
+    parser.add_argument("--event-rate", type=float, default=0, help="Synthetic events per second")
+    parser.add_argument("--event-type", default="volumeChanged")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG)
+    standIn = PlayerStandIn(args.host, args.port, args.delay, args.event_rate, args.event_type)
+    standIn.onRequest(lambda arrival, path: logging.info("Command " + path))
+    try:
+        standIn.run()
+    except KeyboardInterrupt:
+        sys.exit(0)